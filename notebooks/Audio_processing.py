@@ -1,11 +1,15 @@
 import numpy as np
 import librosa
 
+from notebooks.audio_source import open_audio, onset_envelope
+from notebooks.feature_cache import extractor_version
+
 
 def read_wav(path):
-    signal, sr = librosa.load(path)
-    time = np.linspace(0, 1 / sr * len(signal), num=len(signal))
-    return {'signal': signal, 'time': time, 'sr': sr}
+    """
+    Memory-mapped audio at the file sample rate, 'signal' and 'time' are loaded on first access (see AudioDict)
+    """
+    return open_audio(path)
 
 
 def stft(audio_dict, **kwargs):
@@ -16,13 +20,54 @@ def stft(audio_dict, **kwargs):
     return y, S_db
 
 
-def extract_beats(audio_dict):
-    tempo, beats = librosa.beat.beat_track(y=audio_dict['signal'], sr=audio_dict['sr'])
-    beats_time = librosa.frames_to_time(beats, sr=audio_dict['sr'])
-    return beats_time
+def beat_features(audio_dict, hop_len=512):
+    """
+    :return: {'tempo', 'beats' (times), 'onset_env'}
+    """
+    if 'source' in audio_dict:
+        # onset envelope block by block, the whole signal is never loaded
+        envelope = onset_envelope(audio_dict['source'], hop_length=hop_len)
+    else:
+        envelope = librosa.onset.onset_strength(y=audio_dict['signal'], sr=audio_dict['sr'], hop_length=hop_len)
+    tempo, beats = librosa.beat.beat_track(onset_envelope=envelope, sr=audio_dict['sr'], hop_length=hop_len)
+    beats_time = librosa.frames_to_time(beats, sr=audio_dict['sr'], hop_length=hop_len)
+    return {'tempo': float(np.atleast_1d(tempo)[0]), 'beats': beats_time, 'onset_env': envelope}
+
+
+beat_features.version = 2
+
+
+def extract_beats(audio_dict, hop_len=512):
+    return beat_features(audio_dict, hop_len)['beats']
+
+
+extract_beats.version = 2
+
+
+def cached_beat_features(cache, path, hop_len=512):
+    """
+    beat_features of the file from the FeatureCache, computed on the first call only
+    """
+    audio = read_wav(path)
+    return cache.cached(path, 'beat_features', lambda: beat_features(audio, hop_len),
+                        version=extractor_version(beat_features), sr=audio['sr'], hop_len=hop_len)
+
+
+def cached_spectrogram(cache, path, n_fft=2048, hop_len=2048//4):
+    """
+    Magnitude spectrogram in dB of the file (as stft) from the FeatureCache, memory-mapped
+    """
+    audio = read_wav(path)
+    result = cache.cached(path, 'spectrogram', lambda: {'S_db': stft(audio, n_fft=n_fft, hop_len=hop_len)[1]},
+                          version=extractor_version(stft), sr=audio['sr'], n_fft=n_fft, hop_len=hop_len)
+    return result['S_db']
 
 
-def hpss_decompose(y):
-    y_harmonic, y_percussive = librosa.decompose.hpss(y)
-    sig_harmonic, sig_percussive = librosa.istft(y_harmonic), librosa.istft(y_percussive)
-    return sig_harmonic, sig_percussive
\ No newline at end of file
+def hpss_decompose(y, n_fft=2048, hop_len=2048//4):
+    """
+    Harmonic and percussive signals of the waveform y: hpss works on the STFT, not on the waveform
+    """
+    D_harmonic, D_percussive = librosa.decompose.hpss(librosa.stft(y, n_fft=n_fft, hop_length=hop_len))
+    sig_harmonic = librosa.istft(D_harmonic, n_fft=n_fft, hop_length=hop_len, length=len(y))
+    sig_percussive = librosa.istft(D_percussive, n_fft=n_fft, hop_length=hop_len, length=len(y))
+    return sig_harmonic, sig_percussive
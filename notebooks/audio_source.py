@@ -0,0 +1,192 @@
+"""
+Audio sources which do not hold the whole song as a float array.
+
+PCM and float WAV files are memory-mapped, other formats are decoded block by block
+with soundfile. Samples are converted to mono float32 only for the range that is read,
+sample times are computed on demand, feature extractors iterate over blocks.
+"""
+import os
+import struct
+
+import numpy as np
+import librosa
+import soundfile
+
+
+# WAVE format tags
+_PCM, _FLOAT, _EXTENSIBLE = 1, 3, 0xFFFE
+
+
+def _wav_layout(path):
+    """
+    :return: (dtype, channels, sr, data offset, n_samples) of a memory-mappable WAV file, None otherwise
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12:
+            return None
+        riff, _, wave = struct.unpack('<4sI4s', header)
+        if riff != b'RIFF' or wave != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                body = f.read(size)
+                tag, channels, sr, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+                if tag == _EXTENSIBLE and len(body) >= 26:
+                    tag = struct.unpack('<H', body[24:26])[0]
+                fmt = tag, channels, sr, bits
+            elif chunk_id == b'data':
+                if fmt is None:
+                    return None
+                tag, channels, sr, bits = fmt
+                dtype = {(_PCM, 8): 'u1', (_PCM, 16): '<i2', (_PCM, 32): '<i4',
+                         (_FLOAT, 32): '<f4', (_FLOAT, 64): '<f8'}.get((tag, bits))
+                if dtype is None:
+                    return None
+                # streamed WAVs (ffmpeg writing to a pipe) carry a placeholder size, data ends with the file
+                offset = f.tell()
+                size = min(size, os.path.getsize(path) - offset)
+                return dtype, channels, sr, offset, size // (channels * bits // 8)
+            else:
+                f.seek(size + size % 2, 1)
+
+
+class AudioSource:
+    """
+    Read-only view of an audio file, samples are read as mono float32 in [-1, 1] at the file sample rate
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        layout = _wav_layout(path)
+        if layout is not None:
+            dtype, self.channels, self.sr, offset, self.n_samples = layout
+            self._data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(self.n_samples, self.channels))
+        else:
+            info = soundfile.info(path)
+            self.channels, self.sr, self.n_samples = info.channels, info.samplerate, info.frames
+
+    def __len__(self):
+        return self.n_samples
+
+    @property
+    def duration(self):
+        return self.n_samples / self.sr
+
+    def time(self, start=0, stop=None):
+        """
+        Times in seconds of samples [start, stop)
+        """
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        return np.arange(start, stop) / self.sr
+
+    def read(self, start=0, stop=None):
+        """
+        Mono float32 samples [start, stop)
+        """
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        start = min(start, stop)
+        if self._data is None:
+            with soundfile.SoundFile(self.path) as f:
+                f.seek(start)
+                return f.read(stop - start, dtype='float32', always_2d=True).mean(axis=1)
+        samples = self._data[start:stop]
+        kind = samples.dtype.kind
+        if kind == 'u':
+            samples = (samples.astype('float32') - 128) / 128
+        elif kind == 'i':
+            samples = samples.astype('float32') / -np.iinfo(samples.dtype).min
+        else:
+            samples = samples.astype('float32')
+        return samples.mean(axis=1) if self.channels > 1 else samples[:, 0]
+
+    def blocks(self, block_size=2 ** 16, overlap=0, start=0, stop=None):
+        """
+        Consecutive blocks of block_size samples, each extended by overlap samples of the next block
+        :return: iterator of (offset of the block, samples)
+        """
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        for offset in range(start, stop, block_size):
+            yield offset, self.read(offset, min(offset + block_size + overlap, stop))
+
+
+class AudioDict(dict):
+    """
+    read_wav result: {'source', 'sr'}, 'signal' (whole song as float32) and 'time'
+    are computed on first access only, extractors which work on blocks of 'source' never load them
+    """
+
+    def __missing__(self, key):
+        if key == 'signal':
+            value = self['source'].read()
+        elif key == 'time':
+            value = self['source'].time()
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+
+def open_audio(path):
+    source = AudioSource(path)
+    return AudioDict(source=source, sr=source.sr)
+
+
+def onset_envelope(source, hop_length=512, n_fft=2048, block_frames=256, lag=1):
+    """
+    Onset strength (spectral flux of the mel spectrogram in dB, as librosa.onset.onset_strength)
+    computed block by block, memory does not depend on the song length.
+    Frames are centered and zero padded at both ends as in librosa, dB values are not clipped
+    to top_db below the song maximum, which librosa does on the whole song
+    :return: onset envelope at frame times frames * hop_length / sr
+    """
+    n_frames = 1 + len(source) // hop_length
+    envelope = np.zeros(n_frames, dtype='float32')
+    pad = n_fft // 2
+    # flux of frames j and j + lag is the value of frame j + shift, the first shift values are 0 (as librosa)
+    shift = lag + n_fft // (2 * hop_length)
+    pos, previous = shift, None
+    # samples of the zero padded signal are shifted by pad, block k starts at padded sample k * block_size
+    block_size = block_frames * hop_length
+    for frame in range(0, n_frames, block_frames):
+        start = frame * hop_length - pad
+        stop = start + block_size + n_fft - hop_length
+        block = source.read(max(start, 0), max(stop, 0))
+        block = np.pad(block, (max(-start, 0), stop - start - len(block) - max(-start, 0)))
+        S = librosa.power_to_db(librosa.feature.melspectrogram(y=block, sr=source.sr, n_fft=n_fft,
+                                                               hop_length=hop_length, center=False), top_db=None)
+        S = S[:, :n_frames - frame]
+        if previous is not None:
+            S = np.concatenate([previous, S], axis=1)
+        flux = np.maximum(0., S[:, lag:] - S[:, :-lag]).mean(axis=0)
+        flux = flux[:max(n_frames - pos, 0)]
+        envelope[pos:pos + len(flux)] = flux
+        pos += len(flux)
+        previous = S[:, -lag:]
+    return envelope
+
+
+def rms_envelope(source, hop_length=512, frame_length=2048, block_frames=256):
+    """
+    RMS energy per frame computed block by block, same frames as librosa.feature.rms
+    (centered, zero padded at both ends)
+    """
+    n_frames = 1 + len(source) // hop_length
+    rms = np.zeros(n_frames, dtype='float32')
+    pad = frame_length // 2
+    # samples of the zero padded signal are shifted by pad, block k starts at padded sample k * block_size
+    block_size = block_frames * hop_length
+    for pos in range(0, n_frames, block_frames):
+        start = pos * hop_length - pad
+        stop = start + block_size + frame_length - hop_length
+        block = source.read(max(start, 0), max(stop, 0))
+        block = np.pad(block, (max(-start, 0), stop - start - len(block) - max(-start, 0)))
+        frames = np.lib.stride_tricks.sliding_window_view(block, frame_length)[::hop_length][:n_frames - pos]
+        rms[pos:pos + len(frames)] = np.sqrt(np.mean(frames ** 2, axis=1))
+    return rms
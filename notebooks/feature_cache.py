@@ -0,0 +1,174 @@
+"""
+On-disk cache of audio analysis results keyed by audio file content.
+
+Entry of one extractor run on one file with one set of parameters (sr, n_fft, hop length ...):
+
+    <cache_dir>/<key[:2]>/<key>/meta.json   {name, version, params, audio_hash, arrays, values, nbytes}
+    <cache_dir>/<key[:2]>/<key>/<array>.npy
+
+key is a hash of the file content hash, extractor name and parameters. Arrays are loaded
+memory-mapped, json values (tempo and other scalars) are returned as is.
+The extractor version is stored in the entry, not in the key: an entry written by another
+version is dropped on lookup and recomputed in the same slot.
+Entries are evicted least recently used first when the cache grows above max_bytes
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+def content_hash(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def extractor_version(fn):
+    """
+    Version of an extractor function, set as fn.version when its results change
+    """
+    return getattr(fn, 'version', 1)
+
+
+class FeatureCache:
+
+    def __init__(self, cache_dir, max_bytes=2 * 2 ** 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # content hashes by (path, size, mtime), files are hashed once per process
+        self._hashes = {}
+        self.hits = self.misses = self.invalidated = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def audio_hash(self, path):
+        st = os.stat(path)
+        stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if stamp not in self._hashes:
+            self._hashes[stamp] = content_hash(path)
+        return self._hashes[stamp]
+
+    @staticmethod
+    def key(audio_hash, name, params):
+        return hashlib.sha1(json.dumps([audio_hash, name, params], sort_keys=True).encode()).hexdigest()
+
+    def _dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, path, name, version=1, **params):
+        """
+        :return: dict of cached arrays (memory-mapped) and values, None if missing or of another version
+        """
+        entry_dir = self._dir(self.key(self.audio_hash(path), name, params))
+        try:
+            with open(os.path.join(entry_dir, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if meta['version'] != version:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self.invalidated += 1
+            self.misses += 1
+            return None
+        try:
+            result = {array: np.load(os.path.join(entry_dir, f'{array}.npy'), mmap_mode='r')
+                      for array in meta['arrays']}
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        result.update(meta['values'])
+        os.utime(os.path.join(entry_dir, 'meta.json'))
+        self.hits += 1
+        return result
+
+    def put(self, path, name, result, version=1, **params):
+        """
+        :param result: dict of numpy arrays and json serializable values
+        """
+        arrays = {k: v for k, v in result.items() if isinstance(v, np.ndarray)}
+        values = {k: v for k, v in result.items() if k not in arrays}
+        if sum(value.nbytes for value in arrays.values()) > self.max_bytes:
+            return
+        audio_hash = self.audio_hash(path)
+        entry_dir = self._dir(self.key(audio_hash, name, params))
+        tmp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for array, value in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{array}.npy'), value)
+        meta = {'name': name, 'version': version, 'params': params, 'audio_hash': audio_hash,
+                'arrays': list(arrays), 'values': values,
+                'nbytes': sum(os.path.getsize(os.path.join(tmp_dir, f'{array}.npy')) for array in arrays)}
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        self.evict()
+
+    def cached(self, path, name, fn, version=None, **params):
+        """
+        Cached result of fn(), computed and stored on a miss
+        :param version: extractor version, extractor_version(fn) by default
+        """
+        version = extractor_version(fn) if version is None else version
+        result = self.get(path, name, version, **params)
+        if result is None:
+            result = fn()
+            self.put(path, name, result, version, **params)
+        return result
+
+    def entries(self):
+        """
+        :return: list of (last use time, bytes, entry dir, meta)
+        """
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if key.endswith('.tmp'):
+                    continue
+                meta_path = os.path.join(prefix_dir, key, 'meta.json')
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    used = os.path.getmtime(meta_path)
+                except (OSError, ValueError):
+                    continue
+                entries.append((used, meta['nbytes'], os.path.join(prefix_dir, key), meta))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry[0])
+        total = sum(entry[1] for entry in entries)
+        for _, nbytes, entry_dir, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= nbytes
+
+    def invalidate(self, name, keep_version=None):
+        """
+        Remove entries of extractor name, except those of keep_version
+        :return: number of removed entries
+        """
+        removed = 0
+        for _, _, entry_dir, meta in self.entries():
+            if meta['name'] == name and meta['version'] != keep_version:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def stats(self):
+        entries = self.entries()
+        return {'hits': self.hits, 'misses': self.misses, 'invalidated': self.invalidated,
+                'entries': len(entries), 'bytes': sum(entry[1] for entry in entries)}
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
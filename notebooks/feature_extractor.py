@@ -0,0 +1,99 @@
+"""
+Single pass audio feature extraction: the STFT is computed once and every feature is derived from it.
+
+    S_db       magnitude spectrogram in dB (as Audio_processing.stft)
+    onset_env  onset strength from the mel spectrogram of the same STFT (as librosa.onset.onset_strength)
+    beats      tempo and beat times tracked on onset_env
+    hpss       harmonic and percussive signals, median filtering of the same STFT and istft
+    rms        RMS energy per frame
+
+Run as a module to compare with the separate helper calls:
+
+    python -m notebooks.feature_extractor song.wav
+"""
+import sys
+from time import perf_counter
+
+import numpy as np
+import librosa
+
+from notebooks import Audio_processing
+
+
+FEATURES = ('S_db', 'onset_env', 'beats', 'hpss', 'rms')
+
+
+def extract_features(audio_dict, features=FEATURES, n_fft=2048, hop_len=2048//4):
+    """
+    :param features: subset of FEATURES, only the selected ones are computed
+    :return: dict with 'S_db', 'onset_env', 'tempo' and 'beats' (times), 'harmonic' and 'percussive', 'rms'
+             for the selected features
+    """
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f'unknown features {sorted(unknown)}, expected some of {FEATURES}')
+    sr = audio_dict['sr']
+    D = librosa.stft(audio_dict['signal'], n_fft=n_fft, hop_length=hop_len)
+    S = np.abs(D)
+    result = {}
+    if 'S_db' in features:
+        result['S_db'] = librosa.amplitude_to_db(S)
+    if 'onset_env' in features or 'beats' in features:
+        S_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=S ** 2, sr=sr))
+        result['onset_env'] = envelope = librosa.onset.onset_strength(S=S_mel, sr=sr, n_fft=n_fft, hop_length=hop_len)
+        if 'beats' in features:
+            tempo, beats = librosa.beat.beat_track(onset_envelope=envelope, sr=sr, hop_length=hop_len)
+            result['tempo'] = float(np.atleast_1d(tempo)[0])
+            result['beats'] = librosa.frames_to_time(beats, sr=sr, hop_length=hop_len)
+    if 'hpss' in features:
+        D_harmonic, D_percussive = librosa.decompose.hpss(D)
+        length = len(audio_dict['signal'])
+        result['harmonic'] = librosa.istft(D_harmonic, hop_length=hop_len, n_fft=n_fft, length=length)
+        result['percussive'] = librosa.istft(D_percussive, hop_length=hop_len, n_fft=n_fft, length=length)
+    if 'rms' in features:
+        # from the waveform: RMS of the windowed STFT frames would differ from librosa.feature.rms, and it needs no FFT
+        result['rms'] = librosa.feature.rms(y=audio_dict['signal'], frame_length=n_fft, hop_length=hop_len)[0]
+    return result
+
+
+extract_features.version = 1
+
+
+# the same features from the separate helpers, each of them computes its own STFT
+_SEPARATE = {
+    'S_db': lambda audio: Audio_processing.stft(audio),
+    'onset_env': lambda audio: librosa.onset.onset_strength(y=audio['signal'], sr=audio['sr']),
+    'beats': lambda audio: Audio_processing.extract_beats({'signal': audio['signal'], 'sr': audio['sr']}),
+    'hpss': lambda audio: Audio_processing.hpss_decompose(audio['signal']),
+    'rms': lambda audio: librosa.feature.rms(y=audio['signal']),
+}
+
+
+def benchmark(path, feature_sets=(FEATURES, ('S_db', 'onset_env', 'beats', 'rms')), repeat=3):
+    """
+    Time of the separate helper calls against one extract_features pass for every feature set
+    """
+    audio = Audio_processing.read_wav(path)
+    print(f"{len(audio['signal']) / audio['sr']:.1f} s of audio")
+    # warm up numba compiled parts of librosa
+    extract_features(audio)
+    results = {}
+    for features in feature_sets:
+        runs = {
+            'separate': lambda: [_SEPARATE[feature](audio) for feature in features],
+            'single pass': lambda: extract_features(audio, features),
+        }
+        times = {}
+        for name, fn in runs.items():
+            t = perf_counter()
+            for _ in range(repeat):
+                fn()
+            times[name] = (perf_counter() - t) / repeat
+        print(f"{', '.join(features)}: separate {times['separate']:.2f} s, single pass {times['single pass']:.2f} s, "
+              f"speedup {times['separate'] / times['single pass']:.2f}x")
+        results[tuple(features)] = times
+    return results
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1])
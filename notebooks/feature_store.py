@@ -0,0 +1,254 @@
+"""
+Columnar store of per-track audio features for dataset building, filled from a directory of tracks.
+
+    <store_dir>/index.json     {version, hop_len, tracks: [{path, hash, size, mtime_ns, sr, duration, tempo,
+                                                            beats: [offset, count], frames: [offset, count]}]}
+    <store_dir>/beats.f8       beat times of all tracks, float64
+    <store_dir>/onset_env.f4   onset envelope of all tracks, float32, one value per frame of hop_len samples
+    <store_dir>/rms.f4         RMS energy of all tracks, float32, same frames
+
+Columns are flat little endian files which grow by one chunk per track and are read with np.memmap,
+a track is the [offset, offset + count) slice of its columns. Index is rewritten (atomically) after
+every track, column data beyond the index is left by an interrupted run and cut off on open,
+so an interrupted extraction resumes from the last stored track.
+Tracks whose content hash is in the index are skipped, changed tracks are re-analysed and
+their old chunks become dead space until compact().
+
+    python -m notebooks.feature_store <audio_dir> <store_dir> [processes]
+"""
+import json
+import multiprocessing
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from notebooks.Audio_processing import read_wav, beat_features
+from notebooks.audio_source import rms_envelope
+from notebooks.feature_cache import content_hash
+
+
+VERSION = 1
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg', '.mp3')
+# column -> (dtype, per 'beats' or per 'frames')
+COLUMNS = {
+    'beats': ('<f8', 'beats'),
+    'onset_env': ('<f4', 'frames'),
+    'rms': ('<f4', 'frames'),
+}
+
+
+class FeatureStore:
+
+    def __init__(self, store_dir, hop_len=512):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        index_path = os.path.join(store_dir, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+            if self.index['hop_len'] != hop_len:
+                raise ValueError(f"{store_dir} holds features for hop_len {self.index['hop_len']}, not {hop_len}")
+        else:
+            self.index = {'version': VERSION, 'hop_len': hop_len, 'tracks': []}
+        self._truncate()
+
+    def _column_path(self, name):
+        return os.path.join(self.store_dir, f'{name}.{COLUMNS[name][0][1:]}')
+
+    def _column_len(self, name):
+        """
+        Number of values of the column referenced by the index
+        """
+        kind = COLUMNS[name][1]
+        return max((sum(track[kind]) for track in self.index['tracks']), default=0)
+
+    def _truncate(self):
+        # drop chunks written after the last index update (interrupted run)
+        for name, (dtype, _) in COLUMNS.items():
+            path = self._column_path(name)
+            size = self._column_len(name) * np.dtype(dtype).itemsize
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                with open(path, 'ab') as f:
+                    f.truncate(size)
+
+    def write_index(self):
+        path = os.path.join(self.store_dir, 'index.json')
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(f'{path}.tmp', path)
+
+    def __len__(self):
+        return len(self.index['tracks'])
+
+    @property
+    def tracks(self):
+        return self.index['tracks']
+
+    def find(self, path):
+        path = os.path.abspath(path)
+        for ix, track in enumerate(self.tracks):
+            if track['path'] == path:
+                return ix
+        return None
+
+    def column(self, name):
+        """
+        Whole column of all tracks, memory-mapped
+        """
+        dtype = COLUMNS[name][0]
+        n = self._column_len(name)
+        if not n:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(n,))
+
+    def track(self, ix):
+        """
+        Index entry of track ix with its feature arrays (memory-mapped slices)
+        """
+        track = dict(self.tracks[ix])
+        for name, (_, kind) in COLUMNS.items():
+            offset, count = track[kind]
+            track[name] = self.column(name)[offset:offset + count]
+        return track
+
+    def append(self, entry, features):
+        """
+        Store features of one track and replace its previous entry
+        :param entry: index values of the track (path, hash, size, mtime_ns, sr, duration, tempo)
+        :param features: {column name: array}
+        """
+        entry = dict(entry)
+        for name, (dtype, kind) in COLUMNS.items():
+            data = np.ascontiguousarray(features[name], dtype=dtype)
+            path = self._column_path(name)
+            # columns of the same kind always grow together, so they share offsets
+            entry[kind] = [os.path.getsize(path) // data.itemsize, len(data)]
+            with open(path, 'ab') as f:
+                f.write(data.tobytes())
+        self.remove(entry['path'], write=False)
+        self.index['tracks'].append(entry)
+        self.write_index()
+
+    def remove(self, path, write=True):
+        ix = self.find(path)
+        if ix is not None:
+            del self.index['tracks'][ix]
+            if write:
+                self.write_index()
+
+    def dead_values(self):
+        """
+        Number of column values not referenced by any track, left by replaced and removed tracks
+        """
+        return {name: os.path.getsize(self._column_path(name)) // np.dtype(dtype).itemsize
+                - sum(track[kind][1] for track in self.tracks)
+                for name, (dtype, kind) in COLUMNS.items()}
+
+    def compact(self):
+        """
+        Rewrite columns with the chunks of indexed tracks only
+        """
+        tracks = [self.track(ix) for ix in range(len(self))]
+        offsets = {kind: 0 for _, kind in COLUMNS.values()}
+        for name, (dtype, kind) in COLUMNS.items():
+            path = self._column_path(name)
+            with open(f'{path}.tmp', 'wb') as f:
+                for track in tracks:
+                    f.write(np.ascontiguousarray(track[name]).tobytes())
+        for entry in self.tracks:
+            for kind in offsets:
+                entry[kind] = [offsets[kind], entry[kind][1]]
+                offsets[kind] += entry[kind][1]
+        for name in COLUMNS:
+            os.replace(f'{self._column_path(name)}.tmp', self._column_path(name))
+        self.write_index()
+
+
+def _analyse(path, hop_len):
+    """
+    Worker: features of one track, audio is read block by block (see audio_source),
+    so worker memory does not depend on the track length
+    """
+    try:
+        audio = read_wav(path)
+        beats = beat_features(audio, hop_len)
+        source = audio['source']
+        entry = {'sr': audio['sr'], 'duration': source.duration, 'tempo': beats['tempo']}
+        features = {'beats': beats['beats'], 'onset_env': beats['onset_env'],
+                    'rms': rms_envelope(source, hop_length=hop_len)}
+        return path, entry, features, None
+    except Exception as e:
+        return path, None, None, f'{type(e).__name__}: {e}'
+
+
+def scan(audio_dir, extensions=AUDIO_EXTENSIONS):
+    files = []
+    for root, _, names in os.walk(audio_dir):
+        files += [os.path.abspath(os.path.join(root, name)) for name in names if name.lower().endswith(extensions)]
+    return sorted(files)
+
+
+def extract_directory(audio_dir, store_dir, processes=None, hop_len=512, tasks_per_worker=16):
+    """
+    Analyse all tracks of audio_dir (recursively) which are not in the store yet, in a process pool.
+    Workers are replaced after tasks_per_worker tracks so memory held by librosa does not build up.
+    Tracks removed from audio_dir are removed from the store
+    :return: stats {'tracks', 'analysed', 'skipped', 'removed', 'failed' {path: error}, 'seconds'}
+    """
+    t = perf_counter()
+    store = FeatureStore(store_dir, hop_len)
+    files = scan(audio_dir)
+    stats = {'tracks': len(files), 'analysed': 0, 'skipped': 0, 'removed': 0, 'failed': {}}
+
+    root = os.path.join(os.path.abspath(audio_dir), '')
+    present = set(files)
+    for track in list(store.tracks):
+        if track['path'].startswith(root) and track['path'] not in present:
+            store.remove(track['path'])
+            stats['removed'] += 1
+
+    todo = {}
+    for path in files:
+        st = os.stat(path)
+        ix = store.find(path)
+        if ix is not None:
+            track = store.tracks[ix]
+            if (track['size'], track['mtime_ns']) == (st.st_size, st.st_mtime_ns):
+                stats['skipped'] += 1
+                continue
+            file_hash = content_hash(path)
+            if track['hash'] == file_hash:
+                # touched but not changed
+                track.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+                store.write_index()
+                stats['skipped'] += 1
+                continue
+        else:
+            file_hash = content_hash(path)
+        todo[path] = {'path': path, 'hash': file_hash, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    if todo:
+        with multiprocessing.Pool(processes, maxtasksperchild=tasks_per_worker) as pool:
+            results = pool.imap_unordered(_analyse_args, [(path, hop_len) for path in todo])
+            for path, entry, features, error in results:
+                if error is not None:
+                    stats['failed'][path] = error
+                    continue
+                store.append(dict(todo[path], **entry), features)
+                stats['analysed'] += 1
+    stats['seconds'] = perf_counter() - t
+    return stats
+
+
+def _analyse_args(args):
+    return _analyse(*args)
+
+
+if __name__ == '__main__':
+    result = extract_directory(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    print(f"{result['analysed']} analysed, {result['skipped']} skipped, {result['removed']} removed, "
+          f"{len(result['failed'])} failed of {result['tracks']} tracks in {result['seconds']:.1f} s")
+    for path, error in result['failed'].items():
+        print(f'  {path}: {error}')
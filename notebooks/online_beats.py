@@ -0,0 +1,217 @@
+"""
+Online beat tracking for live input: audio arrives in fixed size blocks and beats are emitted
+while the stream plays, without the whole signal.
+
+Onset envelope is extended frame by frame (same values and frame times as audio_source.onset_envelope),
+tempo is re-estimated from the autocorrelation of the last few seconds of the envelope and beat phase
+from a comb over the same window. Beats are predicted one period ahead and emitted when the
+stream reaches them, so latency is bounded by the block duration plus processing time.
+
+FileAudioStream plays a file block by block at real time speed in place of a sound card.
+"""
+from collections import deque
+from time import perf_counter, sleep
+
+import numpy as np
+import librosa
+
+from notebooks.audio_source import AudioSource
+
+
+class FileAudioStream:
+    """
+    File-backed stand-in for a sound card input: mono float32 blocks of block_size samples,
+    with realtime=True each block is delivered when it would have been fully captured
+    """
+
+    def __init__(self, path, block_size=1024, realtime=True):
+        self.path = path
+        self.source = AudioSource(path)
+        self.sr = self.source.sr
+        self.block_size = block_size
+        self.realtime = realtime
+        self.start_time = None
+
+    @property
+    def duration(self):
+        return self.source.duration
+
+    def capture_time(self, t):
+        """
+        Wall clock (perf_counter) time at which audio time t was captured
+        """
+        return self.start_time + t
+
+    def __iter__(self):
+        self.start_time = perf_counter()
+        for offset, block in self.source.blocks(self.block_size):
+            if self.realtime:
+                delay = self.capture_time((offset + len(block)) / self.sr) - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+            else:
+                # as if captured right now
+                self.start_time = perf_counter() - (offset + len(block)) / self.sr
+            yield block
+
+
+class OnlineBeatTracker:
+    """
+    :param window: seconds of onset envelope used for tempo and phase estimation
+    :param update: seconds between tempo and phase updates
+    :param start_bpm: center of the tempo prior (log-normal, one octave deviation as in librosa)
+    """
+
+    def __init__(self, sr, hop_length=512, n_fft=2048, n_mels=128, window=6., update=0.5,
+                 start_bpm=120., min_bpm=60., max_bpm=240., lag=1):
+        self.sr = sr
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.lag = lag
+        self.frame_rate = sr / hop_length
+        self._mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels)
+        self._fft_window = librosa.filters.get_window('hann', n_fft, fftbins=True).astype('float32')
+        # frames are centered: the stream starts with n_fft // 2 zeros as in audio_source.onset_envelope
+        self._samples = np.zeros(n_fft // 2, dtype='float32')
+        self._previous = deque(maxlen=lag)
+        # envelope frame index of the first flux value (see audio_source.onset_envelope)
+        self._shift = lag + n_fft // (2 * hop_length)
+        self._n_frames = self._shift
+        self._envelope = deque(maxlen=int(window * self.frame_rate))
+        self._update_frames = max(int(update * self.frame_rate), 1)
+        self._next_update = int(min(window, 2.) * self.frame_rate)
+
+        lags = np.arange(int(self.frame_rate * 60 / max_bpm), int(self.frame_rate * 60 / min_bpm) + 1)
+        self._lags = lags
+        self._prior = np.exp(-0.5 * (np.log2(60 * self.frame_rate / lags / start_bpm)) ** 2)
+
+        self.position = 0.  # seconds of audio received
+        self.period = None  # beat period in envelope frames
+        self.next_beat = None  # predicted time of the next beat
+        self.beats = []
+        self.latencies = []
+
+    @property
+    def tempo(self):
+        return None if self.period is None else 60 * self.frame_rate / self.period
+
+    def _frames(self, block):
+        """
+        Envelope values of the frames completed by block
+        """
+        self._samples = np.concatenate([self._samples, np.asarray(block, dtype='float32')])
+        n = (len(self._samples) - self.n_fft) // self.hop_length + 1
+        if n <= 0:
+            return []
+        frames = np.lib.stride_tricks.sliding_window_view(self._samples, self.n_fft)[::self.hop_length][:n]
+        power = np.abs(np.fft.rfft(frames * self._fft_window, axis=1)) ** 2
+        S = librosa.power_to_db(self._mel_basis @ power.T, top_db=None)
+        self._samples = self._samples[n * self.hop_length:]
+        values = []
+        for column in S.T:
+            if len(self._previous) == self.lag:
+                values.append(np.maximum(0., column - self._previous[0]).mean())
+            self._previous.append(column)
+        return values
+
+    def _estimate(self):
+        env = np.asarray(self._envelope)
+        env = env - env.mean()
+        lags = self._lags[self._lags < len(env) // 2]
+        if not len(lags) or not env.any():
+            return
+        ac = np.array([env[lag:] @ env[:-lag] for lag in lags]) / len(env)
+        score = ac * self._prior[:len(lags)]
+        i = int(np.argmax(score))
+        period = float(lags[i])
+        if 0 < i < len(lags) - 1:
+            # parabolic interpolation of the peak
+            a, b, c = score[i - 1:i + 2]
+            denominator = a - 2 * b + c
+            if denominator < 0:
+                period += 0.5 * (a - c) / denominator
+        self.period = period
+
+        # phase: comb of beat period over the window, ending at the newest frame
+        n = len(env)
+        offsets = np.arange(int(np.ceil(period)))
+        teeth = np.arange(int((n - 1) / period) + 1) * period
+        ix = n - 1 - np.rint(offsets[:, None] + teeth[None, :]).astype('int')
+        valid = ix >= 0
+        comb = np.where(valid, env[np.clip(ix, 0, None)], 0).sum(axis=1)
+        last_beat_frame = self._n_frames - 1 - offsets[int(np.argmax(comb))]
+        next_beat = last_beat_frame / self.frame_rate
+        # the new grid continues after the last emitted beat: a beat it places just before the newest
+        # frame is emitted late rather than dropped, beats older than one period are skipped
+        now = (self._n_frames - 1) / self.frame_rate
+        after = now if not self.beats else max(self.beats[-1] + 0.5 * period / self.frame_rate,
+                                               now - period / self.frame_rate)
+        while next_beat <= after:
+            next_beat += period / self.frame_rate
+        self.next_beat = next_beat
+
+    def process(self, block):
+        """
+        Feed one block of samples
+        :return: list of beat events {'time', 'tempo'} due in this block
+        """
+        self.position += len(block) / self.sr
+        events = []
+        for value in self._frames(block):
+            self._envelope.append(value)
+            self._n_frames += 1
+            if self._n_frames - self._shift >= self._next_update:
+                # beats of the current grid before this frame are due whatever the update finds
+                events += self._emit((self._n_frames - 1) / self.frame_rate)
+                self._estimate()
+                self._next_update += self._update_frames
+        return events + self._emit(self.position)
+
+    def _emit(self, until):
+        """
+        Beat events of the current grid up to time until
+        """
+        events = []
+        while self.next_beat is not None and self.next_beat <= until:
+            events.append({'time': self.next_beat, 'tempo': self.tempo})
+            self.beats.append(self.next_beat)
+            self.next_beat += self.period / self.frame_rate
+        return events
+
+    def track(self, stream):
+        """
+        Beat events of a stream as they happen, with 'latency': wall time from capture of the beat to its event
+        """
+        for block in stream:
+            for event in self.process(block):
+                event['latency'] = perf_counter() - stream.capture_time(event['time'])
+                self.latencies.append(event['latency'])
+                yield event
+
+    def stats(self):
+        latencies = np.asarray(self.latencies)
+        return {
+            'beats': len(self.beats),
+            'tempo': self.tempo,
+            'latency_mean': float(latencies.mean()) if len(latencies) else None,
+            'latency_max': float(latencies.max()) if len(latencies) else None,
+        }
+
+
+if __name__ == '__main__':
+    # click track at 120 bpm: whatever the block size, every beat after the first estimate is emitted
+    sr, bpm, duration = 22050, 120., 30.
+    signal = np.zeros(int(duration * sr), dtype='float32')
+    n = np.arange(int(0.02 * sr))
+    click = np.sin(2 * np.pi * 1000 * n / sr) * np.exp(-n / 200)
+    for t in np.arange(0, duration, 60 / bpm):
+        signal[int(t * sr):int(t * sr) + len(click)] += click
+    for block_size in (512, 1024, 4096):
+        tracker = OnlineBeatTracker(sr)
+        beats = np.array([event['time'] for start in range(0, len(signal), block_size)
+                          for event in tracker.process(signal[start:start + block_size])])
+        gaps = np.diff(beats)
+        print(f'block {block_size}: {len(beats)} beats, tempo {tracker.tempo:.1f}, gaps {gaps.min():.3f}-{gaps.max():.3f} s')
+        assert abs(tracker.tempo - bpm) < 2
+        assert gaps.max() < 1.25 * 60 / bpm, 'beats dropped'
+        assert len(beats) >= (duration - beats[0]) * bpm / 60 - 1
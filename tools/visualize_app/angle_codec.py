@@ -0,0 +1,78 @@
+"""
+Compact codec for joint angle timelines of shape (N, 6, 3) in degrees.
+
+Angles are stored as int16 centi-degrees (range +-327.67 deg, round-trip error <= MAX_ERROR).
+With delta encoding every frame stores the difference to the previous one, and every
+keyframe_interval-th frame stores the absolute value, so a frame range is decoded
+from the closest preceding keyframe only.
+Deltas use int16 wrap-around arithmetic: decoding is exact for any jump between frames,
+quantization error does not accumulate.
+"""
+import numpy as np
+
+
+SCALE = 100  # centi-degrees
+MAX_ERROR = 0.5 / SCALE
+_INT16 = np.iinfo('int16')
+
+
+def quantize(angles):
+    q = np.rint(np.asarray(angles, dtype='float64') * SCALE)
+    if q.size and (q.min() < _INT16.min or q.max() > _INT16.max):
+        raise ValueError(f'angles out of int16 centi-degree range (+-{_INT16.max / SCALE} deg)')
+    return q.astype('int16')
+
+
+def encode_angles(angles, delta=False, keyframe_interval=None):
+    """
+    :param angles: array (N, 6, 3) of joint angles in degrees
+    :param delta: store frame to frame differences
+    :param keyframe_interval: absolute frame every k frames (delta mode), whole sequence by default
+    :return: {'data': int16 array (N, 6, 3), 'scale', 'delta', 'keyframe_interval'}
+    """
+    q = quantize(angles)
+    k = keyframe_interval or max(len(q), 1)
+    if delta and len(q):
+        data = np.empty_like(q)
+        data[0] = q[0]
+        data[1:] = q[1:] - q[:-1]  # wraps in int16
+        data[::k] = q[::k]
+    else:
+        data = q
+    return {'data': data, 'scale': SCALE, 'delta': bool(delta), 'keyframe_interval': int(k)}
+
+
+def decode_angles(encoded, start=0, stop=None):
+    """
+    Decode frames [start, stop), only blocks between keyframes covering the range are read
+    :return: float64 array (stop - start, 6, 3) in degrees
+    """
+    data = encoded['data']
+    start, stop, _ = slice(start, stop).indices(len(data))
+    stop = max(start, stop)
+    if not encoded['delta']:
+        return data[start:stop] / encoded['scale']
+
+    k = encoded['keyframe_interval']
+    block_start = start // k * k
+    seg = np.asarray(data[block_start:stop])
+    n = len(seg)
+    n_blocks = -(-n // k)
+    padded = np.zeros((n_blocks * k,) + seg.shape[1:], dtype='int16')
+    padded[:n] = seg
+    # every block starts with an absolute keyframe, running sum restores the values
+    q = np.cumsum(padded.reshape((n_blocks, k) + seg.shape[1:]), axis=1, dtype='int16')
+    q = q.reshape(padded.shape)[start - block_start:n]
+    return q / encoded['scale']
+
+
+def decode_frame(encoded, i):
+    return decode_angles(encoded, i, i + 1)[0]
+
+
+def max_error(angles, encoded):
+    """
+    Actual round-trip error, always <= MAX_ERROR for angles in range
+    """
+    angles = np.asarray(angles, dtype='float64')
+    return float(np.abs(decode_angles(encoded) - angles).max()) if angles.size else 0.
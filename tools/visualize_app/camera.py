@@ -0,0 +1,148 @@
+import hashlib
+
+import numpy as np
+from matplotlib import rcParams
+
+
+class Camera:
+    """
+    Fixed camera reproducing the projection of a matplotlib 3D axes
+    (ax.view_init(elev, azim) with set_xlim3d / set_ylim3d / set_zlim3d)
+    and the placement of the axes on a figure of the given pixel size.
+
+    project() maps points of any leading shape (..., 3) to pixel coordinates
+    (x to the right, y down) with one matrix product
+    """
+
+    # 2D data limits matplotlib uses for the projected 3D box
+    VIEW_LIM = (-0.095, 0.09)
+    # box aspect normalization constant of Axes3D.set_box_aspect
+    BOX_ASPECT_NORM = 1.8294640721620434
+    # box faces as corner indices, pairs of opposite faces for x, y and z (see axis3d.Axis._PLANES)
+    PLANES = ((0, 3, 7, 4), (1, 2, 6, 5), (0, 1, 5, 4), (3, 2, 6, 7), (0, 1, 2, 3), (4, 5, 6, 7))
+
+    def __init__(self, width=None, height=None, elev=30, azim=75,
+                 xlim=(-400, 400), ylim=(-400, 400), zlim=(0, 300),
+                 box_aspect=(4, 4, 3), dist=10, focal_length=1):
+        dpi = rcParams['figure.dpi']
+        fig_w, fig_h = rcParams['figure.figsize']
+        self.width = int(width or round(fig_w * dpi))
+        self.height = int(height or round(fig_h * dpi))
+        self.elev, self.azim = elev, azim
+        self.limits = np.array([xlim, ylim, zlim], dtype='float64')
+        self.dist = dist
+        self.focal_length = focal_length
+
+        aspect = np.asarray(box_aspect, dtype='float64')
+        self.box_aspect = aspect * self.BOX_ASPECT_NORM / np.linalg.norm(aspect)
+
+        self.eye = self._eye_position()
+        self.matrix = self._projection_matrix()
+        self.viewport = self._viewport()
+
+    @property
+    def scale(self):
+        """
+        Pixels per typographic point, used to convert line widths and marker sizes
+        """
+        return self.width / rcParams['figure.figsize'][0] / 72
+
+    def _eye_position(self):
+        elev, azim = np.deg2rad(self.elev), np.deg2rad(self.azim)
+        ps = np.array([np.cos(elev) * np.cos(azim), np.cos(elev) * np.sin(azim), np.sin(elev)])
+        return 0.5 * self.box_aspect + self.dist * ps
+
+    def _projection_matrix(self):
+        (xmin, xmax), (ymin, ymax), (zmin, zmax) = self.limits
+        dx, dy, dz = (self.limits[:, 1] - self.limits[:, 0]) / self.box_aspect
+        world = np.array([[1 / dx, 0, 0, -xmin / dx],
+                          [0, 1 / dy, 0, -ymin / dy],
+                          [0, 0, 1 / dz, -zmin / dz],
+                          [0, 0, 0, 1]])
+
+        # viewing axes: u - right of the screen, v - up, w - out of the screen
+        center = 0.5 * self.box_aspect
+        w = self.eye - center
+        w /= np.linalg.norm(w)
+        u = np.cross([0, 0, 1], w)
+        u /= np.linalg.norm(u)
+        v = np.cross(w, u)
+
+        eye_focal = center + (self.eye - center) * self.focal_length
+        rot, shift = np.eye(4), np.eye(4)
+        rot[:3, :3] = [u, v, w]
+        shift[:3, -1] = -eye_focal
+        view = rot @ shift
+
+        e = self.focal_length
+        zfront, zback = -self.dist, self.dist
+        persp = np.array([[e, 0, 0, 0],
+                          [0, e, 0, 0],
+                          [0, 0, (zfront + zback) / (zfront - zback), -2 * zfront * zback / (zfront - zback)],
+                          [0, 0, -1, 0]])
+        return persp @ view @ world
+
+    def _viewport(self):
+        """
+        Square axes box of the default subplot, centered like matplotlib apply_aspect does
+        """
+        left, right = rcParams['figure.subplot.left'], rcParams['figure.subplot.right']
+        bottom, top = rcParams['figure.subplot.bottom'], rcParams['figure.subplot.top']
+        box_w, box_h = (right - left) * self.width, (top - bottom) * self.height
+        size = min(box_w, box_h)
+        x0 = left * self.width + (box_w - size) / 2
+        y0 = bottom * self.height + (box_h - size) / 2
+        return x0, y0, size
+
+    def project(self, points):
+        """
+        :param points: array (..., 3) in data coordinates
+        :return: screen (..., 2) pixel coordinates, depth (...) - larger is farther from the viewer
+        """
+        points = np.asarray(points, dtype='float64')
+        homogeneous = points @ self.matrix[:, :3].T + self.matrix[:, 3]
+        ndc = homogeneous[..., :3] / homogeneous[..., 3:]
+
+        lo, hi = self.VIEW_LIM
+        x0, y0, size = self.viewport
+        screen = np.empty(points.shape[:-1] + (2,))
+        screen[..., 0] = x0 + (ndc[..., 0] - lo) / (hi - lo) * size
+        screen[..., 1] = self.height - (y0 + (ndc[..., 1] - lo) / (hi - lo) * size)
+        return screen, ndc[..., 2]
+
+    def box_corners(self, margin=1 / 48):
+        """
+        8 corners of the axes box (with matplotlib pane margin) in data coordinates,
+        ordered like Axes3D._tunit_cube so PLANES index them
+        """
+        mins, maxs = self.limits[:, 0].copy(), self.limits[:, 1].copy()
+        deltas = (maxs - mins) * margin
+        mins -= deltas
+        maxs += deltas
+        (x0, y0, z0), (x1, y1, z1) = mins, maxs
+        return np.array([[x0, y0, z0], [x1, y0, z0], [x1, y1, z0], [x0, y1, z0],
+                         [x0, y0, z1], [x1, y0, z1], [x1, y1, z1], [x0, y1, z1]])
+
+    def panes(self):
+        """
+        Screen polygons (3, 4, 2) of the back panes of x, y and z axes:
+        of the two box faces normal to an axis the one farther from the viewer is drawn
+        """
+        screen, depth = self.project(self.box_corners())
+        panes = []
+        for i in range(3):
+            near, far = self.PLANES[2 * i], self.PLANES[2 * i + 1]
+            if depth[list(near)].mean() > depth[list(far)].mean():
+                near, far = far, near
+            panes.append(screen[list(far)])
+        return np.array(panes)
+
+    def key(self):
+        """
+        Hashable description of the camera, for caching projected or rendered data
+        """
+        return (self.width, self.height, self.elev, self.azim, tuple(map(tuple, self.limits.tolist())),
+                tuple(self.box_aspect.tolist()), self.dist, self.focal_length)
+
+    def hash(self):
+        return hashlib.sha1(repr(self.key()).encode()).hexdigest()[:16]
@@ -0,0 +1,111 @@
+import os
+import subprocess
+
+from moviepy.config import get_setting
+
+
+class FFmpegEncoder:
+    """
+    Streams raw RGB frames into an ffmpeg subprocess over a pipe.
+
+    Frames are written in order and counted, frame i is shown at i / fps exactly.
+    With audio_path set, ffmpeg reads the audio file itself and muxes it into the output
+    (audio_codec='copy' keeps the stream as is when the container supports it).
+    Output appears at filename only after the encoder finished successfully
+    """
+
+    def __init__(self, filename, size, fps, audio_path=None, codec='libx264', preset='medium',
+                 threads=None, crf=None, gop=None, pix_fmt='yuv420p', audio_codec='aac', extra_args=()):
+        self.filename = filename
+        self.width, self.height = size
+        self.fps = fps
+        self.n_frames = 0
+        root, ext = os.path.splitext(filename)
+        self._tmp_filename = f'{root}.tmp{ext}'
+
+        cmd = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-vcodec", "rawvideo",
+               "-s", f"{self.width}x{self.height}", "-pix_fmt", "rgb24",
+               "-r", str(fps), "-i", "-"]
+        if audio_path is not None:
+            cmd += ["-i", audio_path, "-map", "0:v", "-map", "1:a", "-c:a", audio_codec]
+        cmd += ["-c:v", codec, "-pix_fmt", pix_fmt]
+        if preset is not None:
+            cmd += ["-preset", preset]
+        if crf is not None:
+            cmd += ["-crf", str(crf)]
+        if gop is not None:
+            # keyframe every gop frames, so clips of whole gops can be joined without re-encoding
+            cmd += ["-g", str(gop)]
+        if threads is not None:
+            cmd += ["-threads", str(threads)]
+        cmd += list(extra_args) + [self._tmp_filename]
+        self.cmd = cmd
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.PIPE)
+
+    def write_frame(self, frame):
+        """
+        :param frame: RGB uint8 array (height, width, 3)
+        """
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f'frame {self.n_frames} has shape {frame.shape}, '
+                             f'encoder expects {(self.height, self.width, 3)}')
+        try:
+            self._proc.stdin.write(memoryview(frame.astype('uint8', copy=False).reshape(-1)))
+        except BrokenPipeError:
+            raise IOError(f'ffmpeg stopped at frame {self.n_frames}:\n{self._error()}') from None
+        self.n_frames += 1
+
+    def write_frames(self, frames):
+        for frame in frames:
+            self.write_frame(frame)
+        return self.n_frames
+
+    def _error(self):
+        self._proc.wait()
+        return self._proc.stderr.read().decode(errors='replace')
+
+    def close(self):
+        if self._proc is None:
+            return
+        self._proc.stdin.close()
+        error = self._error()
+        code = self._proc.returncode
+        self._proc = None
+        if code != 0:
+            raise IOError(f'ffmpeg exited with code {code}:\n{error}')
+        os.replace(self._tmp_filename, self.filename)
+
+    def abort(self):
+        if self._proc is None:
+            return
+        self._proc.kill()
+        self._proc.wait()
+        self._proc = None
+        if os.path.exists(self._tmp_filename):
+            os.remove(self._tmp_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def encode_frames(frames, filename, fps, audio_path=None, **options):
+    """
+    Encode frames iterable, frame size is taken from the first frame
+    :param options: FFmpegEncoder options (preset, threads, crf, gop ...)
+    :return: number of encoded frames
+    """
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        raise ValueError(f'no frames to encode into {filename}')
+    with FFmpegEncoder(filename, (first.shape[1], first.shape[0]), fps, audio_path=audio_path, **options) as encoder:
+        encoder.write_frame(first)
+        return encoder.write_frames(frames)
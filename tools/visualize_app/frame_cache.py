@@ -0,0 +1,181 @@
+import hashlib
+import io
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib import rcParams
+
+
+# plot style settings which change the rendered picture (see plotter.py)
+STYLE_PARAMS = ('figure.facecolor', 'figure.dpi', 'figure.figsize', 'axes.facecolor', 'axes.edgecolor',
+                'axes.prop_cycle', 'patch.facecolor', 'lines.linewidth', 'lines.solid_capstyle',
+                'lines.solid_joinstyle', 'scatter.edgecolors', 'axes3d.grid')
+
+
+def style_key():
+    return tuple(str(rcParams[name]) for name in STYLE_PARAMS)
+
+
+class FrameCache:
+    """
+    Content-addressed cache of rendered frames.
+
+    Key is a hash of the geometry quantized to `quantum` data units together with
+    renderer settings (backend, size, view) and plot style, so the same pose drawn
+    in another song or run is found again. Frames are kept in memory in LRU order
+    within max_bytes, with cache_dir set they are also stored on disk (zlib compressed)
+    and when the disk cache grows beyond max_disk_bytes the oldest entries are removed
+    down to 90% of it.
+
+    Cached frames are read-only arrays shared between hits
+    """
+
+    def __init__(self, max_bytes=512 * 2 ** 20, cache_dir=None, max_disk_bytes=None, quantum=0.01):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.quantum = quantum
+        self._frames = OrderedDict()
+        self.nbytes = 0
+        self.reset_stats()
+        # running size of the disk cache, the directory is scanned again only when it is over budget
+        self.disk_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            if max_disk_bytes is not None:
+                self.disk_bytes = sum(entry[1] for entry in self._disk_entries())
+
+    def __getstate__(self):
+        # worker processes get settings and disk cache only
+        state = self.__dict__.copy()
+        state['_frames'] = OrderedDict()
+        state['nbytes'] = 0
+        return state
+
+    def __len__(self):
+        return len(self._frames)
+
+    def reset_stats(self):
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def merge_stats(self, stats):
+        for name in ('hits', 'disk_hits', 'misses', 'evictions'):
+            setattr(self, name, getattr(self, name) + stats[name])
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.,
+            'frames': len(self._frames),
+            'bytes': self.nbytes,
+        }
+
+    def key(self, settings, geometry):
+        """
+        :param settings: renderer.settings_key()
+        :param geometry: (leg_lines, body_poly, body_vertices) of one frame
+        """
+        h = hashlib.sha1(repr((settings, style_key())).encode())
+        for arr in geometry:
+            h.update(np.rint(np.asarray(arr, dtype='float64') / self.quantum).astype('int64').tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.npz')
+
+    def get(self, key):
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+        if self.cache_dir is not None:
+            frame = self._load(key)
+            if frame is not None:
+                self.disk_hits += 1
+                self._remember(key, frame)
+                return frame
+        self.misses += 1
+        return None
+
+    def put(self, key, frame):
+        frame.flags.writeable = False
+        self._remember(key, frame)
+        if self.cache_dir is not None and not os.path.exists(self._path(key)):
+            self._store(key, frame)
+
+    def _remember(self, key, frame):
+        if frame.nbytes > self.max_bytes or key in self._frames:
+            return
+        self._frames[key] = frame
+        self.nbytes += frame.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                frame = np.load(io.BytesIO(zlib.decompress(f.read())))
+        except (OSError, ValueError, zlib.error):
+            return None
+        os.utime(path)
+        frame.flags.writeable = False
+        return frame
+
+    def _store(self, key, frame):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buffer = io.BytesIO()
+        np.save(buffer, frame)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        data = zlib.compress(buffer.getvalue(), 1)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if self.max_disk_bytes is not None:
+            self.disk_bytes += len(data)
+            if self.disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        """
+        :return: list of (last use time, bytes, path) of frames stored on disk
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npz'):
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+        return entries
+
+    def _evict_disk(self):
+        # other processes may write to the same directory, the real size is taken from a scan.
+        # Evicted down to 90% of the budget so the next writes do not scan again right away
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= 0.9 * self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.disk_bytes = total
+
+    def clear(self):
+        self._frames.clear()
+        self.nbytes = 0
@@ -135,6 +135,8 @@ class Hexapod:
         self.legPositionsOnGround = None
         self.localAxes = None
         self.foundSolution = None
+        self.nAxis = None
+        self.height = None
 
         if flags["hasNoPoints"]:
             return
@@ -152,6 +154,9 @@ class Hexapod:
             return
 
         self.foundSolution = True
+        # ground plane wrt the flat body: dot(nAxis, point) + height = 0
+        self.nAxis = solved['nAxis']
+        self.height = solved['height']
         # print("solved['groundLegsNoGravity']", solved['groundLegsNoGravity'][0].name)
         self.legPositionsOnGround = [leg.position for leg in solved['groundLegsNoGravity']]
 
@@ -219,6 +224,8 @@ class Hexapod:
         clone.localAxes = localAxes
         clone.legPositionsOnGround = self.legPositionsOnGround
         clone.foundSolution = self.foundSolution
+        clone.nAxis = self.nAxis
+        clone.height = self.height
         return clone
 
     def _handleComplexTwist(self, verticesList):
@@ -156,3 +156,27 @@ def matrixToAlignVectorAtoB(a,b):
     return r
 
 
+def matricesToAlignVectorsToZ(vectors):
+    """
+    Vectorized matrixToAlignVectorAtoB(a, zAxis) for a batch of unit vectors
+    :param vectors: array (N, 3)
+    :return: rotation matrices (N, 3, 3)
+    """
+    a = np.asarray(vectors, dtype='float64')
+    # v = cross(a, zAxis), c = dot(a, zAxis)
+    vx, vy = a[:, 1], -a[:, 0]
+    c = a[:, 2]
+    s2 = vx * vx + vy * vy
+
+    skews = np.zeros((len(a), 3, 3))
+    skews[:, 0, 2] = vy
+    skews[:, 1, 2] = -vx
+    skews[:, 2, 0] = -vy
+    skews[:, 2, 1] = vx
+
+    # When angle between a and zAxis is zero, cross product is 0, R = I
+    d = np.divide(1 - c, s2, out=np.zeros_like(s2), where=s2 > 0)
+    rotations = np.eye(3) + skews + np.matmul(skews, skews) * d[:, None, None]
+    # a = -zAxis: cross product is 0 as well, rotate by 180 degrees around the x axis
+    rotations[(s2 == 0) & (c < 0)] = np.diag([1., -1., -1.])
+    return rotations
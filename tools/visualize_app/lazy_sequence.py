@@ -0,0 +1,151 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from plotter import SequenceDataGen
+
+
+class _FieldView:
+    """
+    Indexable view over one geometry field of a LazySequence
+    (leg_lines, body_poly or body_vertices), so it can be passed
+    to the renderer in place of SequenceDataGen lists
+    """
+
+    def __init__(self, sequence, field):
+        self.sequence = sequence
+        self.field = field
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, item):
+        return self.sequence.get_field(self.field, item)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class LazySequence:
+    """
+    Sequence of hexapod frames defined by keyframes and interpolation parameters only.
+    Kinematics and ground correction are computed on first access, chunk by chunk,
+    and a bounded number of materialized chunks is kept in LRU order.
+
+    Drop-in replacement of SequenceDataGen for the renderer:
+    get_sequence() appends a segment, leg_lines / body_poly / body_vertices are indexable views
+    """
+
+    FIELDS = ('leg_lines', 'body_poly', 'body_vertices')
+    FIELD_SHAPES = {'joint_angles': (6, 3), 'leg_lines': (6, 3, 4), 'body_poly': (6, 3), 'body_vertices': (3, 7),
+                    'ground_heights': (), 'ground_normals': (3,)}
+
+    def __init__(self, chunk_size=64, max_chunks=16, orient_to_ground=False):
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+
+        self.segments = []
+        self._n_frames = 0
+        self._gen = SequenceDataGen(orient_to_ground)
+        self._chunks = OrderedDict()
+
+        self.leg_lines = _FieldView(self, 'leg_lines')
+        self.body_poly = _FieldView(self, 'body_poly')
+        self.body_vertices = _FieldView(self, 'body_vertices')
+
+    def get_sequence(self, start_pose, end_pose, n_frames, reverse):
+        """
+        Append segment from start to end pose (same signature as SequenceDataGen.get_sequence)
+        Nothing is computed until the frames are accessed
+        """
+        if n_frames <= 0:
+            return
+        length = 2 * n_frames if reverse else n_frames
+        self.segments.append({
+            'start_pose': np.array(start_pose),
+            'end_pose': np.array(end_pose),
+            'n_frames': n_frames,
+            'reverse': reverse,
+            'offset': self._n_frames,
+            'length': length,
+        })
+        self._n_frames += length
+
+    def __len__(self):
+        return self._n_frames
+
+    def joint_angles(self, start=0, stop=None):
+        """
+        Interpolated joint angles of frames [start, stop) without kinematics
+        :return: int array of shape (stop - start, 6, 3)
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        parts = []
+        for seg in self.segments:
+            lo, hi = max(start, seg['offset']), min(stop, seg['offset'] + seg['length'])
+            if lo >= hi:
+                continue
+            angles = SequenceDataGen.get_joint_angles(seg['start_pose'], seg['end_pose'], seg['n_frames'])
+            if seg['reverse']:
+                angles = np.concatenate([angles, angles[::-1]])
+            parts.append(angles[lo - seg['offset']:hi - seg['offset']])
+        if not parts:
+            return np.empty((0, 6, 3), dtype='int')
+        return np.concatenate(parts)
+
+    def with_chunk_size(self, chunk_size):
+        """
+        Sequence of the same segments computed in chunks of chunk_size frames, nothing is materialized
+        """
+        sequence = LazySequence(chunk_size, self.max_chunks, self._gen.orient_to_ground)
+        sequence.segments, sequence._n_frames = list(self.segments), self._n_frames
+        return sequence
+
+    def clear_cache(self):
+        self._chunks.clear()
+
+    def _get_chunk(self, chunk_ix):
+        if chunk_ix in self._chunks:
+            self._chunks.move_to_end(chunk_ix)
+            return self._chunks[chunk_ix]
+
+        start = chunk_ix * self.chunk_size
+        angles = self.joint_angles(start, start + self.chunk_size)
+        chunk = self._gen.compute_geometry([self._gen.joints_to_pose(joints) for joints in angles])
+
+        self._chunks[chunk_ix] = chunk
+        if len(self._chunks) > self.max_chunks:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    def get_field(self, field, item):
+        if isinstance(item, slice):
+            indices = np.arange(*item.indices(len(self)))
+            chunk_ixs, local_ixs = np.divmod(indices, self.chunk_size)
+            parts = [self._get_chunk(c)[field][local_ixs[chunk_ixs == c]]
+                     for c in dict.fromkeys(chunk_ixs.tolist())]
+            return np.concatenate(parts) if parts else np.empty((0,) + self.FIELD_SHAPES[field])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(f'frame index {item} out of range for sequence of {len(self)} frames')
+        chunk_ix, local_ix = divmod(item, self.chunk_size)
+        return self._get_chunk(chunk_ix)[field][local_ix]
+
+    def __getitem__(self, item):
+        """
+        Frame i -> (leg_lines, body_poly, body_vertices) of that frame
+        Slice -> tuple of stacked arrays for the selected frames
+        """
+        return tuple(self.get_field(field, item) for field in self.FIELDS)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_arrays(self):
+        """
+        Materialize whole sequence as dict of arrays (see SequenceDataGen.compute_geometry)
+        """
+        return {field: self.get_field(field, slice(None)) for field in SequenceDataGen.FIELDS}
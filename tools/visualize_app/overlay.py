@@ -0,0 +1,122 @@
+"""
+Audio overlay strip under the hexapod: spectrogram or waveform of the whole song with beat ticks.
+
+The strip is rasterized once per song and frame width, every frame only copies the window
+of the strip around its time into the bottom rows and draws the cursor, so the overlay costs
+a memory copy per frame instead of a redraw
+"""
+import hashlib
+
+import numpy as np
+from matplotlib import colormaps, colors as mcolors, rcParams
+
+from notebooks.Audio_processing import stft
+
+
+def _rgb(color):
+    return (np.array(mcolors.to_rgb(color)) * 255).round().astype('uint8')
+
+
+class AudioOverlay:
+    """
+    :param audio: {'signal', 'sr'} as returned by read_wav
+    :param beat_times: times of the beat ticks in seconds
+    :param kind: 'spectrogram' (log frequency scale) or 'waveform' (peak envelope)
+    :param window: seconds of audio visible in a frame, current time is in the middle
+    """
+
+    KINDS = ('spectrogram', 'waveform')
+
+    def __init__(self, audio, beat_times, kind='spectrogram', height=120, window=4., n_fft=2048, hop_len=512,
+                 cmap='magma', top_db=80.):
+        if kind not in self.KINDS:
+            raise ValueError(f'unknown overlay kind {kind!r}, expected one of {self.KINDS}')
+        self.kind = kind
+        self.height = height
+        self.window = window
+        self.sr = audio['sr']
+        self.duration = len(audio['signal']) / self.sr
+        self.beat_times = np.asarray(beat_times, dtype='float64')
+        self.background = _rgb(rcParams['axes.facecolor'])
+        self.beat_color = _rgb(rcParams['axes.prop_cycle'].by_key()['color'][0])
+        self.cursor_color = _rgb('white')
+        self._strip = None
+        self._strip_width = None
+
+        if kind == 'spectrogram':
+            _, s_db = stft(audio, n_fft=n_fft, hop_len=hop_len)
+            level = np.clip((s_db - (s_db.max() - top_db)) / top_db, 0, 1)
+            self._levels = (level * 255).astype('uint8')  # (bins, stft frames)
+            self._hop_time = hop_len / self.sr
+            self._lut = (colormaps[cmap](np.arange(256))[:, :3] * 255).round().astype('uint8')
+        else:
+            self._signal = np.asarray(audio['signal'])
+
+        h = hashlib.sha1(repr((kind, height, window, n_fft, hop_len, cmap, top_db)).encode())
+        h.update(np.ascontiguousarray(audio['signal']).tobytes())
+        h.update(self.beat_times.tobytes())
+        self.key = h.hexdigest()[:16]
+
+    def _spectrogram(self, times):
+        n_bins = len(self._levels)
+        # log frequency rows, low frequencies at the bottom
+        rows = np.geomspace(1, n_bins - 1, self.height).round().astype('int')[::-1]
+        cols = np.clip(np.rint(times / self._hop_time).astype('int'), 0, self._levels.shape[1] - 1)
+        return self._lut[self._levels[rows][:, cols]]
+
+    def _waveform(self, times):
+        col_time = times[1] - times[0]
+        bounds = np.clip(np.rint(np.append(times, times[-1] + col_time) * self.sr).astype('int'), 0, len(self._signal))
+        # peak of |signal| over the samples of every column, columns without samples stay empty
+        peaks = np.zeros(len(times))
+        nonempty = bounds[1:] > bounds[:-1]
+        if nonempty.any():
+            peaks[nonempty] = np.maximum.reduceat(np.abs(self._signal), bounds[:-1][nonempty])
+        peaks /= max(peaks.max(), 1e-12)
+        mid = (self.height - 1) / 2
+        inside = np.abs(np.arange(self.height)[:, None] - mid) <= peaks[None, :] * mid
+        strip = np.empty((self.height, len(times), 3), dtype='uint8')
+        strip[:] = self.background
+        strip[inside] = self.beat_color // 2 + self.background // 2
+        return strip
+
+    def strip(self, width):
+        """
+        Whole song strip for frames of the given width, padded by half a window on both sides
+        :return: RGB uint8 (height, columns, 3)
+        """
+        if self._strip is not None and self._strip_width == width:
+            return self._strip
+        px_per_sec = width / self.window
+        pad = width // 2
+        n_cols = int(np.ceil(self.duration * px_per_sec)) + 2 * pad + 1
+        times = (np.arange(n_cols) - pad) / px_per_sec
+        strip = self._spectrogram(times) if self.kind == 'spectrogram' else self._waveform(times)
+        outside = (times < 0) | (times > self.duration)
+        strip[:, outside] = self.background
+        for col in np.rint(self.beat_times * px_per_sec).astype('int') + pad:
+            strip[:, max(col - 1, 0):col + 1] = self.beat_color
+        self._strip, self._strip_width = strip, width
+        return strip
+
+    def apply(self, frame, t):
+        """
+        Frame with the strip window around time t blitted into its bottom rows and the cursor at the middle
+        :return: new RGB uint8 frame, the input frame is not modified (it may be a cached read-only frame)
+        """
+        height, width = frame.shape[:2]
+        strip = self.strip(width)
+        rows = min(self.height, height)
+        col = min(int(round(t * width / self.window)), strip.shape[1] - width)
+        out = frame.copy()
+        out[height - rows:] = strip[self.height - rows:, col:col + width]
+        cursor = width // 2
+        out[height - rows:, cursor - 1:cursor + 1] = self.cursor_color
+        return out
+
+    def apply_frames(self, frames, fps, start=0):
+        """
+        Apply to a stream of frames starting at frame start
+        """
+        for i, frame in enumerate(frames, start):
+            yield self.apply(frame, i / fps)
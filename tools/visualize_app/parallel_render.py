@@ -0,0 +1,212 @@
+import os
+import shutil
+import tempfile
+import multiprocessing
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+
+from lazy_sequence import LazySequence
+from encoder import encode_frames
+from renderer import create_renderer, render_geometry
+from sequence_store import SequenceFile, save_sequence
+
+
+# per process state, set by the pool initializer
+_worker = {}
+
+
+def _init_worker(sequence, backend, frame_cache):
+    t = perf_counter()
+    _worker['sequence'] = sequence
+    _worker['renderer'] = create_renderer(backend)
+    _worker['frame_cache'] = frame_cache
+    _worker['setup_time'] = perf_counter() - t
+
+
+def _iter_frames(start, stop, sequence=None):
+    sequence = sequence if sequence is not None else _worker['sequence']
+    renderer = _worker['renderer']
+    leg_lines, body_poly, body_vertices = sequence.leg_lines, sequence.body_poly, sequence.body_vertices
+    return render_geometry(renderer, ((leg_lines[i], body_poly[i], body_vertices[i]) for i in range(start, stop)),
+                           _worker['frame_cache'])
+
+
+def _cache_stats():
+    """
+    Frame cache counters of the last job, merged into the parent cache
+    """
+    cache = _worker['frame_cache']
+    if cache is None:
+        return None
+    stats = cache.stats()
+    cache.reset_stats()
+    return stats
+
+
+def _render_chunk(start, stop):
+    return np.stack(list(_iter_frames(start, stop))), _cache_stats()
+
+
+def _encode_chunk(start, stop, filename, fps, options):
+    return encode_frames(_iter_frames(start, stop), filename, fps, **options), _cache_stats()
+
+
+def _render_job(index, job, options):
+    t = perf_counter()
+    sequence = job['sequence']
+    if isinstance(sequence, str):
+        sequence = SequenceFile(sequence)
+    n_frames = len(sequence.leg_lines)
+    encoded = encode_frames(_iter_frames(0, n_frames, sequence), job['output'], job.get('fps', 30),
+                            audio_path=job.get('audio_path'), **options)
+    report = {'index': index, 'output': job['output'], 'frames': encoded, 'seconds': perf_counter() - t,
+              'worker': os.getpid(), 'worker_setup': _worker['setup_time']}
+    return report, _cache_stats()
+
+
+class ParallelRenderer:
+    """
+    Renders frames on a process pool, every worker owns its own renderer (figure or rasterizer).
+
+    Workers read geometry from a memory-mapped sequence file: a SequenceFile is shared as is,
+    in-memory sequences are written to a temporary one first, LazySequence is sent as keyframes
+    and workers compute kinematics of their chunks themselves.
+    Frame range is split into chunks of chunk_size frames, at most max_pending chunks are
+    in flight, frames are yielded in order. Chunk boundaries are multiples of chunk_size and
+    workers get a LazySequence computed in chunks of the same size, so kinematics of every
+    frame is computed once, by the worker which renders it
+    """
+
+    FIELDS = ('leg_lines', 'body_poly', 'body_vertices')
+
+    def __init__(self, sequence, backend='matplotlib', processes=None, chunk_size=8, max_pending=None,
+                 frame_cache=None):
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * self.processes
+        # every worker gets a copy of the cache settings (memory entries are not sent),
+        # workers share hits only through cache_dir, hit counts are merged back here
+        self.frame_cache = frame_cache
+        self._tmp_dir = None
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                          initargs=(self._share(sequence), backend, frame_cache))
+
+    def _share(self, sequence):
+        if isinstance(sequence, SequenceFile):
+            return sequence
+        if isinstance(sequence, LazySequence):
+            return sequence.with_chunk_size(self.chunk_size)
+        self._tmp_dir = tempfile.mkdtemp(prefix='hexapod_render_')
+        path = os.path.join(self._tmp_dir, 'sequence.seq')
+        save_sequence(path, {field: np.asarray(getattr(sequence, field)) for field in self.FIELDS}, fps=None)
+        return SequenceFile(path)
+
+    def frames(self, start, stop):
+        """
+        RGB uint8 frames [start, stop) in order
+        """
+        pending = deque()
+        bounds = list(range(start - start % self.chunk_size + self.chunk_size, stop, self.chunk_size))
+        chunks = zip([start] + bounds, bounds + [stop])
+        for chunk in chunks:
+            pending.append(self._pool.apply_async(_render_chunk, chunk))
+            if len(pending) >= self.max_pending:
+                yield from self._collect(pending.popleft())
+        while pending:
+            yield from self._collect(pending.popleft())
+
+    def _collect(self, result):
+        value, stats = result.get()
+        if stats is not None:
+            self.frame_cache.merge_stats(stats)
+        return value
+
+    def encode_chunks(self, jobs, fps, **options):
+        """
+        Render and encode every (start, stop, filename) job in a worker, each into its own clip
+        :param options: FFmpegEncoder options
+        :return: number of encoded frames per job
+        """
+        results = [self._pool.apply_async(_encode_chunk, (start, stop, filename, fps, options))
+                   for start, stop, filename in jobs]
+        return [self._collect(result) for result in results]
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BatchRenderer:
+    """
+    Renders many short clips with one renderer per worker process.
+    Workers are started and their renderers are set up once, then reused for every job
+    of every render() call, so per clip cost is rendering and encoding only.
+
+    Job: {'sequence': sequence or path of a sequence file, 'output': video path,
+          'fps': 30, 'audio_path': None}
+    """
+
+    def __init__(self, backend='matplotlib', processes=None, frame_cache=None, **encoder_options):
+        """
+        :param encoder_options: FFmpegEncoder options for all clips (preset, threads, crf ...)
+        """
+        self.processes = processes or os.cpu_count()
+        self.frame_cache = frame_cache
+        self.encoder_options = encoder_options
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                          initargs=(None, backend, frame_cache))
+
+    def render(self, jobs):
+        """
+        Render and encode jobs concurrently, as many at a time as there are workers
+        :return: {'jobs': per job reports in job order, 'frames', 'seconds', 'fps', 'clips_per_second'}
+        """
+        t = perf_counter()
+        results = self._pool.starmap_async(_render_job, [(i, job, self.encoder_options) for i, job in enumerate(jobs)],
+                                           chunksize=1).get()
+        seconds = perf_counter() - t
+
+        reports = []
+        for report, stats in results:
+            if stats is not None:
+                self.frame_cache.merge_stats(stats)
+            report['fps'] = report['frames'] / report['seconds'] if report['seconds'] > 0 else float('nan')
+            reports.append(report)
+        frames = sum(report['frames'] for report in reports)
+        return {
+            'jobs': reports,
+            'frames': frames,
+            'seconds': seconds,
+            'fps': frames / seconds if seconds > 0 else float('nan'),
+            'clips_per_second': len(reports) / seconds if seconds > 0 else float('nan'),
+        }
+
+    @staticmethod
+    def format_report(report):
+        lines = [f"{'job':>4}  {'frames':>7}{'seconds':>9}{'fps':>8}  output"]
+        for job in report['jobs']:
+            lines.append(f"{job['index']:>4}  {job['frames']:>7}{job['seconds']:>9.2f}{job['fps']:>8.1f}  {job['output']}")
+        lines.append(f"total {report['frames']} frames of {len(report['jobs'])} clips in {report['seconds']:.2f} s: "
+                     f"{report['fps']:.1f} fps, {report['clips_per_second']:.2f} clips/s")
+        return '\n'.join(lines)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
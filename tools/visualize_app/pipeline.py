@@ -0,0 +1,122 @@
+import queue
+import threading
+from time import perf_counter
+
+
+_DONE = object()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues, every stage runs in its own thread.
+
+    A stage is a function of the iterable of items produced by the previous stage
+    (the first stage takes no arguments) which returns an iterable of items for the next one.
+    The last stage consumes its input and its return value becomes the result of run().
+    At most queue_size items wait between two stages, so memory does not depend on stream length.
+
+    Stage timings are collected in stats: items received and sent, time waiting for input,
+    time blocked on a full output queue and busy time (the rest)
+    """
+
+    def __init__(self, stages, queue_size=8, poll=0.1):
+        """
+        :param stages: list of (name, function)
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.poll = poll
+        self.stats = {name: {'received': 0, 'sent': 0, 'wait_in': 0., 'wait_out': 0., 'total': 0.}
+                      for name, _ in stages}
+        self.first_item = None
+        self.result = None
+        self._start = None
+        self._error = None
+        self._stop = threading.Event()
+
+    def _receive(self, inbox, stats, last):
+        while True:
+            t = perf_counter()
+            while True:
+                try:
+                    item = inbox.get(timeout=self.poll)
+                    break
+                except queue.Empty:
+                    if self._stop.is_set():
+                        raise _Cancelled
+            stats['wait_in'] += perf_counter() - t
+            if item is _DONE:
+                return
+            if last and self.first_item is None:
+                self.first_item = perf_counter() - self._start
+            stats['received'] += 1
+            yield item
+
+    def _send(self, outbox, item, stats):
+        t = perf_counter()
+        while True:
+            try:
+                outbox.put(item, timeout=self.poll)
+                break
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _Cancelled
+        stats['wait_out'] += perf_counter() - t
+
+    def _run_stage(self, name, fn, inbox, outbox):
+        stats = self.stats[name]
+        t = perf_counter()
+        try:
+            if inbox is None:
+                items = fn()
+            else:
+                items = fn(self._receive(inbox, stats, last=outbox is None))
+            if outbox is None:
+                self.result = items
+            else:
+                for item in items:
+                    self._send(outbox, item, stats)
+                    stats['sent'] += 1
+                self._send(outbox, _DONE, stats)
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+        finally:
+            stats['total'] = perf_counter() - t
+
+    def run(self):
+        self._start = perf_counter()
+        queues = [queue.Queue(self.queue_size) for _ in self.stages[1:]]
+        inboxes = [None] + queues
+        outboxes = queues + [None]
+        threads = [threading.Thread(target=self._run_stage, args=(name, fn, inbox, outbox), name=name, daemon=True)
+                   for (name, fn), inbox, outbox in zip(self.stages, inboxes, outboxes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = perf_counter() - self._start
+        if self._error is not None:
+            raise self._error
+        return self.result
+
+    def report(self):
+        """
+        Stage timing table, the stage with the largest busy time is the bottleneck
+        """
+        lines = [f"{'stage':<10}{'items':>8}{'busy, s':>10}{'wait in, s':>12}{'wait out, s':>13}{'items/s':>10}"]
+        for name, st in self.stats.items():
+            items = st['received'] or st['sent']
+            busy = st['total'] - st['wait_in'] - st['wait_out']
+            rate = items / busy if busy > 0 else float('nan')
+            lines.append(f"{name:<10}{items:>8}{busy:>10.2f}{st['wait_in']:>12.2f}{st['wait_out']:>13.2f}{rate:>10.1f}")
+        if self.first_item is not None:
+            lines.append(f'first item at the last stage after {self.first_item:.2f} s, total {self.elapsed:.2f} s')
+        return '\n'.join(lines)
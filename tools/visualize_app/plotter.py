@@ -1,11 +1,15 @@
 import glob
+from time import perf_counter
 from PIL import Image
 import numpy as np
 from matplotlib import pyplot as plt, rcParams
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from tools.visualize_app.hexapod.hexapod import Hexapod
-from tools.visualize_app.hexapod.model_settings import BASE_DIMENSIONS
+from tools.visualize_app.hexapod.model_settings import BASE_DIMENSIONS, LEG_NAMES
+from tools.visualize_app.hexapod.utils.geometry import matricesToAlignVectorsToZ
+from renderer import HexapodRenderer, create_renderer, render_geometry
 
 
 """ Plot Style Settings """
@@ -39,55 +43,126 @@ class SequenceDataGen:
     constrained for 18 joints 6 legged hexapod model
     """
 
-    def __init__(self):
+    # per frame arrays kept for each sequence
+    FIELDS = ('joint_angles', 'leg_lines', 'body_vertices', 'body_poly', 'ground_heights', 'ground_normals')
 
+    def __init__(self, orient_to_ground=False):
+
+        self.orient_to_ground = orient_to_ground
+
+        self.joint_angles = []
         self.body_vertices = []
         self.body_poly = []
         self.leg_lines = []
+        self.ground_heights = []
+        self.ground_normals = []
 
-    def get_ext_joints_dict(self, start_pose, end_pose, n_frames):
+    @staticmethod
+    def get_joint_angles(start_pose, end_pose, n_frames):
+        """
+        Linear interpolation of 18 joint angles from start to end pose
+        :return: int array of shape (n_frames, 6, 3)
+        """
         s = np.ravel(start_pose)
         e = np.ravel(end_pose)
-        poses = []
-        for i in range(18):
-            poses.append(np.linspace(s[i], e[i], n_frames).astype('int'))
-
-        sequence = []
-        for i in range(n_frames):
-            sequence.append(
-                {
-                    'rightMiddle': {'alpha': poses[0][i], 'beta': poses[1][i], 'gamma': poses[2][i]},
-                    'rightFront': {'alpha': poses[3][i], 'beta': poses[4][i], 'gamma': poses[5][i]},
-                    'leftFront': {'alpha': poses[6][i], 'beta': poses[7][i], 'gamma': poses[8][i]},
-                    'leftMiddle': {'alpha': poses[9][i], 'beta': poses[10][i], 'gamma': poses[11][i]},
-                    'leftBack': {'alpha': poses[12][i], 'beta': poses[13][i], 'gamma': poses[14][i]},
-                    'rightBack': {'alpha': poses[15][i], 'beta': poses[16][i], 'gamma': poses[17][i]}
-                }
-            )
-        return sequence
+        return np.linspace(s, e, n_frames).astype('int').reshape(n_frames, 6, 3)
 
-    def update_sequence(self, joint_sequence, reverse=False):
-        for pos in joint_sequence:
-            hexapod = Hexapod(BASE_DIMENSIONS, pos)
+    @staticmethod
+    def joints_to_pose(joints):
+        return {leg: {'alpha': a, 'beta': b, 'gamma': g} for leg, (a, b, g) in zip(LEG_NAMES, joints)}
 
-            pts = []
-            for leg in hexapod.legs:
-                pts.append(self.unpack_vector_list(leg.allPointsList))
-            leg_pts = np.array(pts)
+    @staticmethod
+    def pose_to_joints(pose):
+        return [[pose[leg]['alpha'], pose[leg]['beta'], pose[leg]['gamma']] for leg in LEG_NAMES]
 
-            # setup z-axis min point to be on the ground with bias (crappy correction)
-            local_bias = min(leg_pts[::,2][::,3])
-            leg_pts[::,2] -= local_bias
+    def get_ext_joints_dict(self, start_pose, end_pose, n_frames):
+        joint_angles = self.get_joint_angles(start_pose, end_pose, n_frames)
+        return [self.joints_to_pose(joints) for joints in joint_angles]
 
-            vertices = np.array(self.unpack_vector_list(hexapod.body.verticesList, cyclic=True))
-            vertices[2] -= local_bias
+    def compute_geometry(self, joint_sequence):
+        """
+        Forward kinematics with ground correction for a batch of poses
+        :return: dict of arrays
+            joint_angles (N, 6, 3), leg_lines (N, 6, 3, 4), body_vertices (N, 3, 7), body_poly (N, 6, 3),
+            ground_heights (N,) - z bias applied to put the model on the ground,
+            ground_normals (N, 3) - ground plane normal wrt the flat body
+        """
+        joint_sequence = list(joint_sequence)
+        joints = np.array([self.pose_to_joints(pos) for pos in joint_sequence]).reshape(-1, 6, 3)
+        # held poses: kinematics only for the first frame of every run of identical poses
+        changed = np.ones(len(joints), dtype='bool')
+        changed[1:] = np.any(joints[1:] != joints[:-1], axis=(1, 2))
+        run_ids = np.cumsum(changed) - 1
+
+        legs, body, normals, heights = [], [], [], []
+        for ix in np.flatnonzero(changed):
+            hexapod = Hexapod(BASE_DIMENSIONS, joint_sequence[ix])
+            legs.append([self.unpack_vector_zip_list(leg.allPointsList) for leg in hexapod.legs])
+            body.append(self.unpack_vector_zip_list(hexapod.body.verticesList))
+            normals.append([hexapod.nAxis.x, hexapod.nAxis.y, hexapod.nAxis.z])
+            heights.append(hexapod.height)
+
+        n = len(legs)
+        legs = np.array(legs, dtype='float64').reshape(n, 6, 4, 3)
+        body = np.array(body, dtype='float64').reshape(n, 6, 3)
+        normals = np.array(normals, dtype='float64').reshape(n, 3)
+        heights = np.array(heights, dtype='float64')
+
+        # hexapod points are shifted up by solved height, align from the flat body frame
+        shift = np.array([0, 0, 1]) * heights[:, None, None]
+        # body contact points (first point of each leg) and body vertices never touch the ground
+        candidates = np.arange(24)[np.arange(24) % 4 != 0]
+        points, bias = self.align_to_ground(np.concatenate([legs.reshape(n, 24, 3), body], axis=1) - shift,
+                                            normals, heights, self.orient_to_ground, candidates)
+        legs, body = points[:, :24].reshape(n, 6, 4, 3), points[:, 24:]
+
+        return {
+            'joint_angles': joints,
+            'leg_lines': legs.transpose(0, 1, 3, 2)[run_ids],
+            'body_vertices': np.concatenate([body, body[:, :1]], axis=1).transpose(0, 2, 1)[run_ids],
+            'body_poly': body[run_ids],
+            'ground_heights': bias[run_ids],
+            'ground_normals': normals[run_ids],
+        }
+
+    @staticmethod
+    def align_to_ground(points, normals, heights, orient=False, contact_candidates=slice(None)):
+        """
+        Put points of the whole sequence on the ground plane found by the orientation solver
+        :param points: (N, M, 3) points wrt the flat body frame
+        :param normals, heights: (N, 3), (N,) ground planes: dot(normal, point) + height = 0,
+            used by orient only
+        :param orient: rotate the body so the ground plane becomes horizontal
+            (ground contact points end up at z = 0), otherwise the body stays level
+            and is lifted so that its lowest point which may touch the ground is at z = 0
+        :param contact_candidates: index of points which may touch the ground
+        :return: aligned points (N, M, 3), z bias (N,)
+        """
+        if orient:
+            # solver normal is the body "up" axis: dot(normal, point) + height >= 0 for all points,
+            # whatever the sign of its z component, so it is used as is
+            rotations = matricesToAlignVectorsToZ(normals)
+            points = np.einsum('nij,nmj->nmi', rotations, points)
+            bias = heights
+        else:
+            # level body: the solved plane may be tilted, so the lowest candidate is taken over all of them
+            points = points.copy()
+            bias = -points[:, contact_candidates, 2].min(axis=1)
+        points[..., 2] += bias[:, None]
+        return points, bias
+
+    def extend(self, geometry):
+        """
+        Concatenate computed geometry (dict of arrays) with stored sequence
+        """
+        for field in self.FIELDS:
+            getattr(self, field).extend(geometry[field])
 
-            poly = np.array(self.unpack_vector_zip_list(hexapod.body.verticesList))
-            poly[::,2] -= local_bias
+    def to_arrays(self):
+        return {field: np.array(getattr(self, field)) for field in self.FIELDS}
 
-            self.leg_lines.append(leg_pts)
-            self.body_vertices.append(vertices)
-            self.body_poly.append(poly)
+    def update_sequence(self, joint_sequence, reverse=False):
+        self.extend(self.compute_geometry(joint_sequence))
 
         if reverse:
             self.update_sequence(joint_sequence[::-1], reverse=False)
@@ -130,6 +205,29 @@ class SequenceDataGen:
         return out
 
 
+class FrameClock:
+    """
+    Playback clock, maps time to the index of the frame due at that time.
+    Time is counted from start() on the wall clock unless time_source is given
+    """
+
+    def __init__(self, frame_time, time_source=None):
+        self.frame_time = frame_time
+        self.time_source = time_source
+        self._start = None
+
+    def start(self):
+        self._start = perf_counter()
+
+    def time(self):
+        if self.time_source is not None:
+            return self.time_source()
+        return perf_counter() - self._start
+
+    def frame(self):
+        return int(self.time() / self.frame_time)
+
+
 class Plotter:
 
     def __init__(self, savefig=False, save_dir='../../misc/figs'):
@@ -138,56 +236,100 @@ class Plotter:
         self.frame_speed = 0.02  # seconds per frame
 
     def draw_hexapod(self, leg_lines, body_poly, body_vertices):
-
-        fig = plt.figure()
-        ax = fig.add_subplot(projection='3d')
-
-        # stand_pts = [
-        #     [-300, -300, 0],
-        #     [300, -300, 0],
-        #     [300, 300, 0],
-        #     [-300, 300, 0]
-        # ]
-        for i in range(len(leg_lines)):
-            plt.cla()
-            plt.gcf().canvas.mpl_connect('key_release_event',
-                                         lambda event: [exit(0) if event.key == 'escape' else None])
-
-            # plot base stand polygon
-            # base_poly = Poly3DCollection([stand_pts], alpha=0.5)
-            # ax.add_collection3d(base_poly)
-
-            # plot hexapod body polygon
-            poly = Poly3DCollection([body_poly[i]], alpha=0.5)
-            ax.add_collection3d(poly)
-            # plot poly vertices
-            ax.plot(body_vertices[i][0], body_vertices[i][1], body_vertices[i][2])
-            ax.scatter(body_vertices[i][0], body_vertices[i][1], body_vertices[i][2])
-            # plot legs
-            for leg in leg_lines[i]:
-                ax.plot(leg[0], leg[1], leg[2])
-                ax.scatter(leg[0], leg[1], leg[2])
-
-            # remove axis info
-            for axis in [ax.xaxis, ax.yaxis, ax.zaxis]:
-                axis._axinfo['tick']['inward_factor'] = 0.0
-                axis._axinfo['tick']['outward_factor'] = 0.0
-
-            # setup current frame settings
-            ax.set_xlim3d([-400,400])
-            ax.set_ylim3d([-400,400])
-            ax.set_zlim3d([0,300])
-            # ax.margins(x=0, y=-0.25, z=50)
-            # ax.set_aspect('equal')
-            ax.view_init(elev=30, azim=75)
-
-            if self.savefig and i:
-                plt.savefig(f'{self.save_dir}/{str(i).zfill(3)}.png')
-
-            plt.pause(0.1)
+        # figure and artists are created once, frames only update their data
+        stats = self.play(leg_lines, body_poly, body_vertices)
+        print(f"played {stats['drawn']} of {stats['frames']} frames at {stats['fps']:.1f} fps, "
+              f"{stats['dropped']} dropped")
 
         if self.savefig:
-            self.make_gif()
+            self.export_gif(leg_lines, body_poly, body_vertices)
+
+    def play(self, leg_lines, body_poly, body_vertices, time_source=None, blit=True):
+        """
+        Real-time playback at frame_speed seconds per frame.
+        Frame shown is picked by the clock, not by a frame counter: when drawing falls behind
+        the late frames are dropped, when it is ahead the loop waits for the next frame time.
+        Escape stops playback.
+        :param time_source: callable returning playback position in seconds, e.g. position of an
+                            audio player to keep frames in sync with the music; wall clock by default
+        :return: {'frames', 'drawn', 'dropped', 'seconds', 'fps'}
+        """
+        n_frames = len(leg_lines)
+        renderer = HexapodRenderer(blit=blit)
+        canvas = renderer.fig.canvas
+        stopped = []
+        canvas.mpl_connect('key_release_event', lambda event: stopped.append(True) if event.key == 'escape' else None)
+        plt.show(block=False)
+
+        clock = FrameClock(self.frame_speed, time_source)
+        drawn = dropped = 0
+        last = -1
+        clock.start()
+        try:
+            while not stopped:
+                i = clock.frame()
+                if i >= n_frames:
+                    break
+                if i <= last:
+                    # ahead of the clock, keep the GUI responsive until the next frame is due
+                    canvas.start_event_loop(max((last + 1) * self.frame_speed - clock.time(), 0.001))
+                    continue
+                dropped += i - last - 1
+                renderer.update(leg_lines[i], body_poly[i], body_vertices[i])
+                renderer.draw()
+                if blit:
+                    canvas.blit(renderer.fig.bbox)
+                canvas.flush_events()
+                drawn += 1
+                last = i
+            seconds = clock.time()
+            if not stopped:
+                dropped += n_frames - 1 - last
+        finally:
+            renderer.close()
+        return {
+            'frames': n_frames,
+            'drawn': drawn,
+            'dropped': dropped,
+            'seconds': seconds,
+            'fps': drawn / seconds if seconds > 0 else float('nan'),
+        }
+
+    def export_gif(self, leg_lines, body_poly, body_vertices, output=None, width=640, backend='matplotlib',
+                   palette_frames=16):
+        """
+        Render frames headless at the target width straight into an animated GIF, no image files or pauses.
+        One palette is computed from palette_frames frames spread over the sequence and shared by all frames,
+        frames are quantized and handed to the encoder one by one in sequence order
+        :return: output path
+        """
+        output = output or f'{self.save_dir}/output.gif'
+        n_frames = len(leg_lines)
+        if not n_frames:
+            raise ValueError('no frames to export')
+        fig_w, fig_h = rcParams['figure.figsize']
+        if backend == 'numpy':
+            renderer = create_renderer(backend, width=width, height=int(round(width * fig_h / fig_w)))
+        else:
+            # same layout as the full size figure, only the resolution changes
+            fig = Figure(dpi=width / fig_w)
+            FigureCanvasAgg(fig)
+            renderer = create_renderer(backend, fig=fig)
+
+        def frames(indices):
+            return render_geometry(renderer, ((leg_lines[i], body_poly[i], body_vertices[i]) for i in indices))
+
+        try:
+            sample = np.unique(np.linspace(0, n_frames - 1, min(n_frames, palette_frames)).astype('int'))
+            palette = Image.fromarray(np.concatenate(list(frames(sample)))).quantize(256, method=Image.Quantize.MEDIANCUT)
+            images = (Image.fromarray(frame).quantize(palette=palette, dither=Image.Dither.NONE)
+                      for frame in frames(range(n_frames)))
+            first = next(images)
+            first.save(output, format='GIF', save_all=True, append_images=images,
+                       duration=int(round(self.frame_speed * 1000)), loop=0)
+        finally:
+            renderer.close()
+        return output
 
     def make_gif(self):
 
@@ -196,7 +338,7 @@ class Plotter:
 
         images = []
         basewidth = 640
-        files = glob.glob(target)
+        files = sorted(glob.glob(target))
         # Create images list
         for filename in files:
             img = Image.open(filename)
@@ -205,7 +347,8 @@ class Plotter:
             img = img.resize((basewidth, hsize), Image.LANCZOS)
 
             images.append(img)
-        duration = len(files) * self.frame_speed
+        # duration of one frame in milliseconds
+        duration = int(round(self.frame_speed * 1000))
         images[0].save(output, format='GIF', append_images=images[1:], save_all=True, duration=duration, loop=0)
 
 #  Test routine
@@ -242,4 +385,13 @@ if __name__ == "__main__":
     s.get_sequence(start_pose=start, end_pose=end, n_frames=20, reverse=True)
     s.get_sequence(start_pose=start, end_pose=new_end, n_frames=20, reverse=True)
 
+    # ground alignment: pose whose solved normal points down, no joint or foot (leg points past the
+    # body contact) may go below the ground in either mode
+    flipped = [[39, 3, -87], [-87, 8, 26], [74, 80, 20], [-70, 43, -7], [-87, -7, 61], [-42, 4, 68]]
+    for orient in (False, True):
+        check = SequenceDataGen(orient_to_ground=orient)
+        check.get_sequence(start_pose=flipped, end_pose=flipped, n_frames=1, reverse=False)
+        lowest = np.min(np.asarray(check.leg_lines)[..., 2, 1:])
+        assert abs(lowest) < 1e-6, f'orient_to_ground={orient}: lowest leg point at z={lowest}'
+
     Plotter(savefig=True).draw_hexapod(s.leg_lines, s.body_poly, s.body_vertices)
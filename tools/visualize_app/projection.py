@@ -0,0 +1,104 @@
+"""
+Projection stage: hexapod geometry of a whole sequence -> screen coordinates and depth for a fixed camera.
+
+Camera, limits and view never change between frames, so all frames are projected with one
+matrix product per point set. The result is stored next to the sequence file and reused
+by 2D renderers (NumpyRasterizer.render_projected) and by overlay or annotation drawing.
+"""
+import numpy as np
+
+from sequence_store import SequenceFile, save_sequence
+
+
+# point sets: name -> (sequence field, xyz axis precedes points axis in the field, points shape of a frame)
+POINT_SETS = {
+    'legs': ('leg_lines', True, (6, 4)),                # (N, 6, 3, 4) -> (N, 6, 4)
+    'body_poly': ('body_poly', False, (6,)),            # (N, 6, 3) -> (N, 6)
+    'body_vertices': ('body_vertices', True, (7,)),     # (N, 3, 7) -> (N, 7)
+}
+
+
+def project_geometry(camera, leg_lines, body_poly, body_vertices):
+    """
+    Screen coordinates and depth of the hexapod geometry, for one frame or a stack of frames
+    :return: dict of (screen, depth) for 'legs' (..., 6, 4), 'body_poly' (..., 6), 'body_vertices' (..., 7)
+    """
+    geometry = {'leg_lines': leg_lines, 'body_poly': body_poly, 'body_vertices': body_vertices}
+    projected = {}
+    for name, (field, xyz_first, _) in POINT_SETS.items():
+        points = np.asarray(geometry[field])
+        projected[name] = camera.project(np.swapaxes(points, -1, -2) if xyz_first else points)
+    return projected
+
+
+class Projection:
+    """
+    Projected sequence, arrays '<set>_screen' (N, ..., 2) and '<set>_depth' (N, ...) in float32.
+    projection[i] is one frame in the format of NumpyRasterizer.render_projected
+    """
+
+    def __init__(self, arrays, camera_hash=None):
+        self.arrays = arrays
+        self.camera_hash = camera_hash
+
+    @classmethod
+    def compute(cls, sequence, camera, chunk_size=1024):
+        """
+        :param sequence: anything with leg_lines / body_poly / body_vertices sliceable by frames
+        """
+        n_frames = len(sequence.leg_lines)
+        arrays = {}
+        for name, (_, _, shape) in POINT_SETS.items():
+            points_shape = (n_frames,) + shape
+            arrays[f'{name}_screen'] = np.empty(points_shape + (2,), dtype='float32')
+            arrays[f'{name}_depth'] = np.empty(points_shape, dtype='float32')
+        # chunks keep temporary float64 arrays small for long memory-mapped sequences
+        for start in range(0, n_frames, chunk_size):
+            stop = min(start + chunk_size, n_frames)
+            chunk = cls.from_geometry(camera, *(getattr(sequence, field)[start:stop]
+                                                for field, _, _ in POINT_SETS.values()))
+            for name, array in chunk.arrays.items():
+                arrays[name][start:stop] = array
+        return cls(arrays, camera.hash())
+
+    @classmethod
+    def from_geometry(cls, camera, leg_lines, body_poly, body_vertices):
+        """
+        Projection of stacked frames of geometry (N, ...)
+        """
+        arrays = {}
+        for name, (screen, depth) in project_geometry(camera, leg_lines, body_poly, body_vertices).items():
+            arrays[f'{name}_screen'] = np.asarray(screen, dtype='float32')
+            arrays[f'{name}_depth'] = np.asarray(depth, dtype='float32')
+        return cls(arrays, camera.hash())
+
+    def __len__(self):
+        return len(self.arrays['legs_screen'])
+
+    def __getitem__(self, item):
+        return {name: (self.arrays[f'{name}_screen'][item], self.arrays[f'{name}_depth'][item])
+                for name in POINT_SETS}
+
+    def frame_arrays(self, i):
+        """
+        Flat tuple of the frame arrays, for comparing frames and hashing them
+        """
+        return tuple(self.arrays[f'{name}_{kind}'][i] for name in POINT_SETS for kind in ('screen', 'depth'))
+
+    @staticmethod
+    def from_frame_arrays(arrays):
+        it = iter(arrays)
+        return {name: (next(it), next(it)) for name in POINT_SETS}
+
+    def save(self, path, fps=None, **meta):
+        save_sequence(path, self.arrays, fps=fps, camera=self.camera_hash, **meta)
+
+    @classmethod
+    def load(cls, path, camera, **meta):
+        """
+        Memory-mapped projection stored by save, None if it was made for another camera or sequence
+        """
+        stored = SequenceFile(path)
+        if not stored.matches(camera=camera.hash(), **meta):
+            return None
+        return cls({name: stored[name] for name in stored.names}, stored.meta['camera'])
@@ -0,0 +1,197 @@
+import numpy as np
+from matplotlib import colors as mcolors, rcParams
+
+from camera import Camera
+from projection import project_geometry
+
+
+def _rgba(color, alpha=None):
+    return np.array(mcolors.to_rgba(color, alpha), dtype='float32')
+
+
+def _segment_distance(xs, ys, start, end):
+    """
+    Distance from pixel centers (h, w) to the segment start-end
+    """
+    d = end - start
+    px, py = xs - start[0], ys - start[1]
+    t = np.clip((px * d[0] + py * d[1]) / max(float(d @ d), 1e-12), 0, 1)
+    return np.hypot(px - t * d[0], py - t * d[1])
+
+
+class NumpyRasterizer:
+    """
+    Headless renderer drawing the hexapod with numpy only.
+
+    The static background (figure, axes box and panes) is rasterized once,
+    for every frame only the pixels around the hexapod primitives are blended:
+    anti-aliased thick polylines for legs and body outline, convex body polygon
+    and disc markers for joints. Camera and style follow the matplotlib renderer,
+    so both backends produce the same picture (up to anti-aliasing details).
+
+    Same interface as HexapodRenderer: render(leg_lines, body_poly, body_vertices) -> RGB uint8 (H, W, 3)
+    """
+
+    def __init__(self, width=None, height=None, camera=None, simple=False):
+        self.camera = camera if camera is not None else Camera(width, height)
+        # simplified style for previews: lines only, no joint markers and no translucent body polygon
+        self.simple = simple
+        self.width, self.height = self.camera.width, self.camera.height
+        scale = self.camera.scale
+
+        # style of plotter.py rcParams, scatter size is the Axes3D.scatter default
+        self.line_color = _rgba(rcParams['axes.prop_cycle'].by_key()['color'][0])
+        self.line_radius = rcParams['lines.linewidth'] * scale / 2
+        self.cap_projecting = rcParams['lines.solid_capstyle'] == 'projecting'
+        self.poly_color = _rgba(rcParams['patch.facecolor'], 0.5)
+        self.marker_color = self.line_color
+        self.marker_edge_color = _rgba(rcParams['scatter.edgecolors'])
+        self.marker_radius = np.sqrt(20) * scale / 2
+        self.marker_edge_width = 1 * scale
+
+        self._background = self._draw_background()
+        self.frame = self._background.copy()
+
+    def _draw_background(self):
+        frame = np.zeros((self.height, self.width, 3), dtype='uint8')
+        frame[:] = np.rint(_rgba(rcParams['figure.facecolor'])[:3] * 255)
+
+        x0, y0, size = self.camera.viewport
+        top = self.height - (y0 + size)
+        frame[int(round(top)):int(round(top + size)), int(round(x0)):int(round(x0 + size))] = \
+            np.rint(_rgba(rcParams['axes.facecolor'])[:3] * 255)
+
+        default_panes = [(0.95, 0.95, 0.95, 0.5), (0.9, 0.9, 0.9, 0.5), (0.925, 0.925, 0.925, 0.5)]
+        for axis, pane, default in zip('xyz', self.camera.panes(), default_panes):
+            color = _rgba(rcParams.get(f'axes3d.{axis}axis.panecolor', default))
+            self._fill_polygon(frame, pane, color)
+            self._draw_polyline(frame, np.vstack([pane, pane[:1]]), color, 0.5 * self.camera.scale)
+        return frame
+
+    @staticmethod
+    def _region(frame, points, pad):
+        h, w = frame.shape[:2]
+        x0, y0 = np.floor(points.min(0) - pad).astype(int)
+        x1, y1 = np.ceil(points.max(0) + pad).astype(int) + 1
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        ys, xs = np.mgrid[y0:y1, x0:x1].astype('float32') + 0.5
+        return (slice(y0, y1), slice(x0, x1)), xs, ys
+
+    @staticmethod
+    def _blend(frame, region, coverage, color):
+        """
+        Source-over blending of a solid color with per-pixel coverage in [0, 1]
+        """
+        alpha = (coverage * color[3])[..., None]
+        dst = frame[region].astype('float32')
+        dst += alpha * (color[:3] * 255 - dst)
+        frame[region] = np.rint(dst)
+
+    def _draw_polyline(self, frame, points, color, radius, projecting=False):
+        points = np.asarray(points, dtype='float32')
+        if projecting and len(points) > 1:
+            points = points.copy()
+            for end, prev in ((0, 1), (-1, -2)):
+                d = points[end] - points[prev]
+                norm = np.hypot(*d)
+                if norm > 0:
+                    points[end] += d / norm * radius
+        # segment by segment, tight regions keep distance fields small for long diagonal legs
+        for start, end in zip(points[:-1], points[1:]) if len(points) > 1 else [(points[0], points[0])]:
+            found = self._region(frame, np.stack([start, end]), radius + 1)
+            if found is None:
+                continue
+            region, xs, ys = found
+            dist = _segment_distance(xs, ys, start, end)
+            self._blend(frame, region, np.clip(radius + 0.5 - dist, 0, 1), color)
+
+    def _fill_polygon(self, frame, points, color):
+        """
+        Anti-aliased convex polygon (projection of a planar convex polygon stays convex)
+        """
+        points = np.asarray(points, dtype='float32')
+        found = self._region(frame, points, 1)
+        if found is None:
+            return
+        region, xs, ys = found
+        edges = np.roll(points, -1, axis=0) - points
+        area2 = (points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1]).sum()
+        if abs(area2) < 1e-6:
+            return
+        # inward normals, signed distance to every edge line, inside is positive
+        normals = np.stack([-edges[:, 1], edges[:, 0]], axis=1) * np.sign(area2)
+        normals /= np.maximum(np.hypot(normals[:, 0], normals[:, 1]), 1e-12)[:, None]
+        dist = ((xs[..., None] - points[:, 0]) * normals[:, 0] + (ys[..., None] - points[:, 1]) * normals[:, 1]).min(-1)
+        self._blend(frame, region, np.clip(dist + 0.5, 0, 1), color)
+
+    def _draw_markers(self, frame, points, depth):
+        outer = self.marker_radius + self.marker_edge_width / 2
+        inner = self.marker_radius - self.marker_edge_width / 2
+        # farther markers first, as Path3DCollection does
+        for point in points[np.argsort(depth)[::-1]]:
+            found = self._region(frame, point[None], outer + 1)
+            if found is None:
+                continue
+            region, xs, ys = found
+            dist = np.hypot(xs - point[0], ys - point[1])
+            self._blend(frame, region, np.clip(inner + 0.5 - dist, 0, 1), self.marker_color)
+            ring = np.clip(outer + 0.5 - dist, 0, 1) - np.clip(inner + 0.5 - dist, 0, 1)
+            self._blend(frame, region, ring, self.marker_edge_color)
+
+    def project(self, leg_lines, body_poly, body_vertices):
+        """
+        Screen coordinates and depth of the hexapod geometry, for one frame or a stack of frames
+        (see projection.project_geometry)
+        """
+        return project_geometry(self.camera, leg_lines, body_poly, body_vertices)
+
+    def draw_projected(self, projected):
+        """
+        Draw one frame of projected geometry (see project) into self.frame
+        """
+        frame = self.frame
+        frame[:] = self._background
+        (legs, legs_depth), (poly, poly_depth), (body, body_depth) = \
+            projected['legs'], projected['body_poly'], projected['body_vertices']
+
+        # same order as Axes3D.draw: lines, then collections sorted by depth
+        self._draw_polyline(frame, body, self.line_color, self.line_radius, self.cap_projecting)
+        for leg in legs:
+            self._draw_polyline(frame, leg, self.line_color, self.line_radius, self.cap_projecting)
+        if self.simple:
+            return frame
+
+        collections = [(poly_depth.min(), lambda: self._fill_polygon(frame, poly, self.poly_color)),
+                       (body_depth.min(), lambda: self._draw_markers(frame, body, body_depth))]
+        collections += [(d.min(), lambda leg=leg, d=d: self._draw_markers(frame, leg, d))
+                        for leg, d in zip(legs, legs_depth)]
+        for _, draw in sorted(collections, key=lambda item: item[0], reverse=True):
+            draw()
+        return frame
+
+    def render_projected(self, projected):
+        self.draw_projected(projected)
+        return self.frame.copy()
+
+    def render(self, leg_lines, body_poly, body_vertices):
+        return self.render_projected(self.project(leg_lines, body_poly, body_vertices))
+
+    def render_frames(self, leg_lines, body_poly, body_vertices):
+        """
+        Render stacked frames, projecting the whole stack with one matrix product
+        :return: generator of RGB uint8 frames
+        """
+        projected = self.project(leg_lines, body_poly, body_vertices)
+        for i in range(len(projected['legs'][0])):
+            yield self.render_projected({name: (screen[i], depth[i]) for name, (screen, depth) in projected.items()})
+
+    def settings_key(self):
+        """
+        Backend, frame size and view of the rendered frames, for caching them
+        """
+        return ('numpy', self.simple) + self.camera.key()
+
+    def close(self):
+        pass
@@ -0,0 +1,153 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib import collections as mcoll
+from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+
+class HexapodRenderer:
+    """
+    Matplotlib renderer which creates figure, axes and artists once
+    and only pushes new vertex data to them for every frame.
+
+    With blit=True the static part of the figure (background, panes) is rendered once,
+    then only the hexapod artists are drawn on top of the cached background.
+    Colors and line widths come from the plot style settings in plotter.py
+    """
+
+    def __init__(self, fig=None, ax=None, blit=True):
+        self.fig = fig if fig is not None else plt.figure()
+        self.ax = ax if ax is not None else self.fig.add_subplot(projection='3d')
+        self.blit = blit
+        self._background = None
+
+        self._setup_axes()
+        self._create_artists()
+
+    def _setup_axes(self):
+        ax = self.ax
+        # remove axis info
+        for axis in [ax.xaxis, ax.yaxis, ax.zaxis]:
+            axis._axinfo['tick']['inward_factor'] = 0.0
+            axis._axinfo['tick']['outward_factor'] = 0.0
+
+        # setup frame settings
+        ax.set_xlim3d([-400, 400])
+        ax.set_ylim3d([-400, 400])
+        ax.set_zlim3d([0, 300])
+        ax.view_init(elev=30, azim=75)
+        ax.set_autoscale_on(False)
+
+    def _create_artists(self):
+        ax = self.ax
+        empty = np.zeros(1)
+
+        # hexapod body polygon
+        self.poly = Poly3DCollection([np.zeros((6, 3))], alpha=0.5)
+        ax.add_collection3d(self.poly)
+        # poly vertices
+        self.body_line, = ax.plot(empty, empty, empty)
+        self.body_points = ax.scatter(empty, empty, empty)
+        # legs
+        self.leg_lines = [ax.plot(empty, empty, empty)[0] for _ in range(6)]
+        self.leg_points = [ax.scatter(empty, empty, empty) for _ in range(6)]
+
+        self.artists = [self.poly, self.body_line, self.body_points] + self.leg_lines + self.leg_points
+        for artist in self.artists:
+            artist.set_animated(self.blit)
+
+    def update(self, leg_lines, body_poly, body_vertices):
+        """
+        Push geometry of one frame to the artists
+        """
+        self.poly.set_verts([body_poly])
+        self.body_line.set_data_3d(*body_vertices)
+        self.body_points._offsets3d = tuple(body_vertices)
+        for line, points, leg in zip(self.leg_lines, self.leg_points, leg_lines):
+            line.set_data_3d(*leg)
+            points._offsets3d = tuple(leg)
+
+    def _draw_blit(self):
+        canvas = self.fig.canvas
+        if self._background is None:
+            canvas.draw()
+            self._background = canvas.copy_from_bbox(self.fig.bbox)
+        else:
+            canvas.restore_region(self._background)
+
+        # same order as Axes3D.draw: lines, then collections sorted by depth
+        lines = [a for a in self.artists if not isinstance(a, mcoll.Collection)]
+        collections = sorted((a for a in self.artists if isinstance(a, mcoll.Collection)),
+                             key=lambda artist: artist.do_3d_projection(), reverse=True)
+        for artist in lines + collections:
+            self.ax.draw_artist(artist)
+
+    def draw(self):
+        if self.blit:
+            self._draw_blit()
+        else:
+            self.fig.canvas.draw()
+
+    def to_image(self):
+        """
+        Current canvas content as RGB uint8 array (H, W, 3)
+        """
+        return np.asarray(self.fig.canvas.buffer_rgba())[..., :3].copy()
+
+    def render(self, leg_lines, body_poly, body_vertices):
+        self.update(leg_lines, body_poly, body_vertices)
+        self.draw()
+        return self.to_image()
+
+    def settings_key(self):
+        """
+        Backend, frame size and view of the rendered frames, for caching them
+        """
+        ax = self.ax
+        size = tuple(int(v) for v in self.fig.canvas.get_width_height())
+        return ('matplotlib', size, ax.elev, ax.azim, ax.get_xlim3d(), ax.get_ylim3d(), ax.get_zlim3d())
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def render_geometry(renderer, geometry, cache=None, render=None, keyed=False):
+    """
+    Render (leg_lines, body_poly, body_vertices) tuples in order.
+    Consecutive identical poses (holds) are rendered once, the same frame is yielded again.
+    With cache (FrameCache) set, frames of poses drawn before are taken from it.
+    render(*item) draws other per-frame items (i.e. projected points), renderer.render by default,
+    with keyed set geometry then yields (key, item) pairs, key being the (leg_lines, body_poly, body_vertices)
+    tuple of the item: holds and cache entries are found by 3D geometry, so frames drawn from projected
+    points share cache entries with the other paths
+    """
+    render = render or renderer.render
+    settings = renderer.settings_key() if cache is not None else None
+    previous, frame = None, None
+    for key, item in geometry if keyed else ((item, item) for item in geometry):
+        if previous is None or not all(np.array_equal(a, b) for a, b in zip(key, previous)):
+            if cache is None:
+                frame = render(*item)
+            else:
+                cache_key = cache.key(settings, key)
+                frame = cache.get(cache_key)
+                if frame is None:
+                    frame = render(*item)
+                    cache.put(cache_key, frame)
+            previous = key
+        yield frame
+
+
+def create_renderer(backend='matplotlib', **kwargs):
+    """
+    Renderer for video export by backend name, see RENDER_BACKENDS
+    """
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f'unknown render backend {backend!r}, expected one of {sorted(RENDER_BACKENDS)}')
+    if backend == 'numpy':
+        # matplotlib free at render time, imported on demand
+        from raster_backend import NumpyRasterizer
+        return NumpyRasterizer(**kwargs)
+    return HexapodRenderer(**kwargs)
+
+
+RENDER_BACKENDS = ('matplotlib', 'numpy')
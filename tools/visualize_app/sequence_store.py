@@ -0,0 +1,173 @@
+"""
+On-disk sequence format
+
+    magic      6 bytes   b'3DMSEQ'
+    version    uint16    little endian
+    header_len uint32    little endian, length of json header
+    header     json      {version, fps, n_frames, audio_hash, angle_codec, meta,
+                          arrays: {name: {dtype, shape, offset}}}
+    arrays     raw C-ordered data, each array starts at ALIGN bytes boundary
+
+Arrays are read back with np.memmap without copying, so several rendering processes
+can share one sequence file and only pages that are touched are loaded.
+Joint angles may be stored quantized (see angle_codec), codec parameters are kept in the header
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+from angle_codec import encode_angles, decode_angles
+
+
+MAGIC = b'3DMSEQ'
+VERSION = 1
+ALIGN = 64
+_PREFIX = struct.Struct('<6sHI')
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_sequence(path, arrays, fps, audio_hash=None, angle_codec=None, **meta):
+    """
+    Write sequence arrays (dict name -> array with frames on the first axis) in one pass
+    :param angle_codec: encode_angles kwargs (i.e. {'delta': True, 'keyframe_interval': 30})
+        to store joint_angles as int16 centi-degrees, None keeps them as is
+    :param meta: extra json serializable values stored in header (i.e. timeline_key)
+    """
+    arrays = dict(arrays)
+    codec = None
+    if angle_codec is not None and 'joint_angles' in arrays:
+        encoded = encode_angles(arrays['joint_angles'], **angle_codec)
+        arrays['joint_angles'] = encoded.pop('data')
+        codec = encoded
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    n_frames = len(next(iter(arrays.values()))) if arrays else 0
+
+    header = {
+        'version': VERSION,
+        'fps': fps,
+        'n_frames': n_frames,
+        'audio_hash': audio_hash,
+        'angle_codec': codec,
+        'meta': meta,
+        'arrays': {},
+    }
+    # offsets depend on header length and vice versa, grow data start until header fits
+    layout = header['arrays']
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, arr in arrays.items():
+            layout[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+            offset = _align(offset + arr.nbytes)
+        header_bytes = json.dumps(header).encode()
+        if _PREFIX.size + len(header_bytes) <= data_start:
+            break
+        data_start = _align(_PREFIX.size + len(header_bytes))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.seek(layout[name]['offset'])
+            arr.tofile(f)
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+
+
+class SequenceFile:
+    """
+    Read-only memory-mapped sequence.
+    Provides the same leg_lines / body_poly / body_vertices fields as SequenceDataGen,
+    so it can be passed to the renderer directly.
+    Pickles as a path, workers map the file themselves
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a sequence file')
+            if version > VERSION:
+                raise ValueError(f'{path}: unsupported sequence file version {version} (max {VERSION})')
+            self.header = json.loads(f.read(header_len))
+        self.version = version
+        self.fps = self.header['fps']
+        self.audio_hash = self.header['audio_hash']
+        self.meta = self.header['meta']
+        self.angle_codec = self.header.get('angle_codec')
+        self._arrays = {}
+
+    def __reduce__(self):
+        return SequenceFile, (self.path,)
+
+    def __len__(self):
+        return self.header['n_frames']
+
+    def __contains__(self, name):
+        return name in self.header['arrays']
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            spec = self.header['arrays'][name]
+            shape = tuple(spec['shape'])
+            if 0 in shape:
+                self._arrays[name] = np.empty(shape, dtype=spec['dtype'])
+            else:
+                self._arrays[name] = np.memmap(self.path, dtype=spec['dtype'], mode='r',
+                                               offset=spec['offset'], shape=shape)
+        return self._arrays[name]
+
+    @property
+    def names(self):
+        return list(self.header['arrays'])
+
+    def matches(self, fps=None, audio_hash=None, **meta):
+        """
+        Check that the stored sequence was computed for the same settings
+        """
+        if fps is not None and fps != self.fps:
+            return False
+        if audio_hash is not None and audio_hash != self.audio_hash:
+            return False
+        return all(self.meta.get(name) == value for name, value in meta.items())
+
+    def to_arrays(self):
+        arrays = {name: self[name] for name in self.names}
+        if 'joint_angles' in arrays:
+            arrays['joint_angles'] = self.joint_angles
+        return arrays
+
+    def decode_joint_angles(self, start=0, stop=None):
+        """
+        Joint angles of frames [start, stop) in degrees, decoding only needed blocks if quantized
+        """
+        if self.angle_codec is None:
+            return self['joint_angles'][start:stop]
+        return decode_angles(dict(self.angle_codec, data=self['joint_angles']), start, stop)
+
+    @property
+    def joint_angles(self):
+        return self.decode_joint_angles()
+
+    @property
+    def leg_lines(self):
+        return self['leg_lines']
+
+    @property
+    def body_poly(self):
+        return self['body_poly']
+
+    @property
+    def body_vertices(self):
+        return self['body_vertices']
+
+    @property
+    def ground_heights(self):
+        return self['ground_heights']
@@ -0,0 +1,179 @@
+"""
+Skeleton export for playback without server side rendering.
+
+Skeleton is the 24 leg points (LEG_NAMES x LEG_POINT_TYPES_LIST), body hexagon is formed by
+the body contact points of the legs, so no separate body points are stored.
+
+Binary stream format:
+
+    magic      4 bytes   b'HXSK'
+    version    uint16    little endian
+    header_len uint32    little endian, length of json header
+    header     json      {version, fps, n_frames, audio_offset, quantum, dtype,
+                          points: [{leg, type}], edges: [[i, j]], body: [i, ...]}
+    frames     int16     (n_frames, n_points, 3) little endian, position = value * quantum
+
+audio_offset is the audio time in seconds of the first frame.
+The glTF variant stores the same skeleton as a skinned line mesh with one joint node per point
+and a translation animation channel per joint
+"""
+import base64
+import json
+import struct
+
+import numpy as np
+
+from tools.visualize_app.hexapod.model_settings import LEG_NAMES, LEG_POINT_TYPES_LIST
+
+
+MAGIC = b'HXSK'
+VERSION = 1
+_PREFIX = struct.Struct('<4sHI')
+_INT16 = np.iinfo('int16')
+
+N_POINTS = len(LEG_NAMES) * len(LEG_POINT_TYPES_LIST)
+
+
+def topology():
+    """
+    :return: points [{leg, type}], edges [[i, j]] of leg chains and body hexagon, body point indices
+    """
+    n_types = len(LEG_POINT_TYPES_LIST)
+    points = [{'leg': leg, 'type': point_type} for leg in LEG_NAMES for point_type in LEG_POINT_TYPES_LIST]
+    edges = [[leg * n_types + i, leg * n_types + i + 1] for leg in range(len(LEG_NAMES)) for i in range(n_types - 1)]
+    body = [leg * n_types for leg in range(len(LEG_NAMES))]
+    edges += [[body[i], body[(i + 1) % len(body)]] for i in range(len(body))]
+    return points, edges, body
+
+
+def skeleton_points(sequence, start=0, stop=None):
+    """
+    Skeleton points of frames [start, stop) from sequence leg_lines (N, 6, 3, 4)
+    :return: float64 array (stop - start, 24, 3)
+    """
+    leg_lines = np.asarray(sequence.leg_lines[start:stop], dtype='float64')
+    return leg_lines.transpose(0, 1, 3, 2).reshape(len(leg_lines), N_POINTS, 3)
+
+
+def export_skeleton_stream(path, sequence, fps, audio_offset=0., quantum=0.1, chunk_size=1024):
+    """
+    Write sequence as binary skeleton stream, positions quantized to int16 steps of quantum units
+    """
+    n_frames = len(sequence.leg_lines)
+    points, edges, body = topology()
+    header = {
+        'version': VERSION,
+        'fps': fps,
+        'n_frames': n_frames,
+        'audio_offset': audio_offset,
+        'quantum': quantum,
+        'dtype': '<i2',
+        'points': points,
+        'edges': edges,
+        'body': body,
+    }
+    header_bytes = json.dumps(header).encode()
+    with open(path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for start in range(0, n_frames, chunk_size):
+            q = np.rint(skeleton_points(sequence, start, start + chunk_size) / quantum)
+            if q.size and (q.min() < _INT16.min or q.max() > _INT16.max):
+                raise ValueError(f'points out of int16 range for quantum {quantum} (+-{_INT16.max * quantum} units)')
+            f.write(q.astype('<i2').tobytes())
+
+
+def read_skeleton_stream(path):
+    """
+    :return: header dict, float32 points (n_frames, n_points, 3)
+    """
+    with open(path, 'rb') as f:
+        magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a skeleton stream')
+        if version > VERSION:
+            raise ValueError(f'{path}: unsupported skeleton stream version {version} (max {VERSION})')
+        header = json.loads(f.read(header_len))
+        data = np.frombuffer(f.read(), dtype=header['dtype'])
+    points = data.reshape(header['n_frames'], len(header['points']), 3).astype('float32') * header['quantum']
+    return header, points
+
+
+def _pad4(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def export_gltf(path, sequence, fps, audio_offset=0., embed=True):
+    """
+    Write sequence as glTF 2.0 animation: joint node per skeleton point, skinned LINES mesh over them,
+    one translation channel per joint sampled at frame times.
+    With embed=False the binary buffer is written next to the .gltf file as .bin
+    """
+    pos = skeleton_points(sequence).astype('float32')  # (N, P, 3)
+    n_frames = len(pos)
+    if not n_frames:
+        raise ValueError('no frames to export')
+    points, edges, body = topology()
+    bind = pos[0]
+
+    inverse_bind = np.tile(np.eye(4, dtype='float32'), (N_POINTS, 1, 1))
+    inverse_bind[:, 3, :3] = -bind  # column major translation
+    chunks = {
+        'positions': bind.tobytes(),
+        'joints': np.pad(np.arange(N_POINTS, dtype='uint16')[:, None], ((0, 0), (0, 3))).tobytes(),
+        'weights': np.pad(np.ones((N_POINTS, 1), dtype='float32'), ((0, 0), (0, 3))).tobytes(),
+        'indices': np.array(edges, dtype='uint16').tobytes(),
+        'inverse_bind': inverse_bind.tobytes(),
+        'times': (np.arange(n_frames, dtype='float32') / fps).tobytes(),
+        'translations': np.ascontiguousarray(pos.transpose(1, 0, 2)).tobytes(),  # joint major
+    }
+    buffer, views = b'', {}
+    for name, data in chunks.items():
+        views[name] = {'buffer': 0, 'byteOffset': len(buffer), 'byteLength': len(data)}
+        buffer += _pad4(data)
+
+    buffer_views = list(views.values())
+    view_ix = {name: i for i, name in enumerate(views)}
+    accessors = [
+        {'bufferView': view_ix['positions'], 'componentType': 5126, 'count': N_POINTS, 'type': 'VEC3',
+         'min': bind.min(0).tolist(), 'max': bind.max(0).tolist()},
+        {'bufferView': view_ix['joints'], 'componentType': 5123, 'count': N_POINTS, 'type': 'VEC4'},
+        {'bufferView': view_ix['weights'], 'componentType': 5126, 'count': N_POINTS, 'type': 'VEC4'},
+        {'bufferView': view_ix['indices'], 'componentType': 5123, 'count': 2 * len(edges), 'type': 'SCALAR'},
+        {'bufferView': view_ix['inverse_bind'], 'componentType': 5126, 'count': N_POINTS, 'type': 'MAT4'},
+        {'bufferView': view_ix['times'], 'componentType': 5126, 'count': n_frames, 'type': 'SCALAR',
+         'min': [0.], 'max': [float((n_frames - 1) / fps)]},
+    ]
+    samplers, channels = [], []
+    for joint in range(N_POINTS):
+        accessors.append({'bufferView': view_ix['translations'], 'byteOffset': joint * n_frames * 12,
+                          'componentType': 5126, 'count': n_frames, 'type': 'VEC3'})
+        samplers.append({'input': 5, 'output': len(accessors) - 1, 'interpolation': 'LINEAR'})
+        channels.append({'sampler': joint, 'target': {'node': joint, 'path': 'translation'}})
+
+    if embed:
+        uri = 'data:application/octet-stream;base64,' + base64.b64encode(buffer).decode()
+    else:
+        bin_path = path.rsplit('.', 1)[0] + '.bin'
+        with open(bin_path, 'wb') as f:
+            f.write(buffer)
+        uri = bin_path.replace('\\', '/').rsplit('/', 1)[-1]
+
+    nodes = [{'name': f"{p['leg']}.{p['type']}", 'translation': bind[i].tolist()} for i, p in enumerate(points)]
+    nodes.append({'name': 'hexapod', 'mesh': 0, 'skin': 0})
+    gltf = {
+        'asset': {'version': '2.0', 'generator': '3dm-gen skeleton_export'},
+        'scene': 0,
+        'scenes': [{'nodes': list(range(len(nodes)))}],
+        'nodes': nodes,
+        'meshes': [{'name': 'skeleton', 'primitives': [{
+            'attributes': {'POSITION': 0, 'JOINTS_0': 1, 'WEIGHTS_0': 2}, 'indices': 3, 'mode': 1}]}],
+        'skins': [{'joints': list(range(N_POINTS)), 'inverseBindMatrices': 4}],
+        'animations': [{'name': 'dance', 'samplers': samplers, 'channels': channels}],
+        'buffers': [{'byteLength': len(buffer), 'uri': uri}],
+        'bufferViews': buffer_views,
+        'accessors': accessors,
+        'extras': {'fps': fps, 'audio_offset': audio_offset, 'body': body},
+    }
+    with open(path, 'w') as f:
+        json.dump(gltf, f)
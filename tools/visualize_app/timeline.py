@@ -0,0 +1,93 @@
+import hashlib
+
+import numpy as np
+
+
+def segment_key(start_pose, end_pose, n_frames, reverse=False):
+    """
+    Content key of a segment: identical poses and length give identical frames
+    """
+    h = hashlib.sha1()
+    h.update(np.asarray(start_pose, dtype='float64').tobytes())
+    h.update(np.asarray(end_pose, dtype='float64').tobytes())
+    h.update(f'{n_frames}:{int(reverse)}'.encode())
+    return h.hexdigest()[:16]
+
+
+class Timeline:
+    """
+    Frame layout of a dance sequence: list of segments between keyframes (moves).
+    Each segment remembers which keyframes it depends on and which frame range it covers,
+    so an edited move invalidates only the adjacent segments
+    """
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.segments = []
+        self.n_frames = 0
+
+    @classmethod
+    def from_events(cls, events, moves, audio_len, fps):
+        """
+        Segment layout used by VideoGenerator: one segment between each pair of events
+        and a hold of the last move up to the end of the audio
+        """
+        timeline = cls(fps)
+        vid_dt = 1. / fps
+        for ix in range(len(events) - 1):
+            n_frames = int(np.floor((events[ix + 1] - events[ix]) / vid_dt))
+            timeline.add_segment(moves[ix], moves[ix + 1], n_frames, keyframes=(ix, ix + 1))
+        # filling
+        n_fr_miss = int((audio_len - timeline.n_frames / fps) * fps)
+        timeline.add_segment(moves[-1], moves[-1], n_fr_miss, keyframes=(len(moves) - 1,))
+        return timeline
+
+    def add_segment(self, start_pose, end_pose, n_frames, keyframes=(), reverse=False):
+        if n_frames <= 0:
+            return
+        length = 2 * n_frames if reverse else n_frames
+        self.segments.append({
+            'start_pose': start_pose,
+            'end_pose': end_pose,
+            'n_frames': n_frames,
+            'reverse': reverse,
+            'keyframes': tuple(keyframes),
+            'frames': (self.n_frames, self.n_frames + length),
+            'key': segment_key(start_pose, end_pose, n_frames, reverse),
+        })
+        self.n_frames += length
+
+    def __len__(self):
+        return len(self.segments)
+
+    @property
+    def keys(self):
+        return [seg['key'] for seg in self.segments]
+
+    @property
+    def key(self):
+        """
+        Content key of the whole timeline
+        """
+        return hashlib.sha1(f"{self.fps}:{','.join(self.keys)}".encode()).hexdigest()[:16]
+
+    def dependent_frames(self, keyframe_ix):
+        """
+        Frame ranges [start, stop) that change when keyframe (move) keyframe_ix is edited
+        """
+        return [seg['frames'] for seg in self.segments if keyframe_ix in seg['keyframes']]
+
+    def diff(self, previous):
+        """
+        Indices of segments which are not present in previous timeline and must be recomputed
+        """
+        known = set() if previous is None else set(previous.keys)
+        return [ix for ix, seg in enumerate(self.segments) if seg['key'] not in known]
+
+    def fill(self, sequence):
+        """
+        Feed segments into SequenceDataGen or LazySequence
+        """
+        for seg in self.segments:
+            sequence.get_sequence(start_pose=seg['start_pose'], end_pose=seg['end_pose'],
+                                  n_frames=seg['n_frames'], reverse=seg['reverse'])
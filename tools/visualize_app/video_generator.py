@@ -1,88 +1,514 @@
+import hashlib
+import os
+import tempfile
+from fractions import Fraction
+from time import perf_counter
+
 import numpy as np
-import librosa
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
-from moviepy.editor import VideoClip, AudioFileClip
-from moviepy.video.io.bindings import mplfig_to_npimage
+from matplotlib import rcParams
+from moviepy.config import get_setting
+from moviepy.tools import subprocess_call
 
 from plotter import SequenceDataGen
-
-
-def extract_beats(audio_dict):
-    tempo, beats = librosa.beat.beat_track(y=audio_dict['signal'], sr=audio_dict['sr'])
-    beats_time = librosa.frames_to_time(beats, sr=audio_dict['sr'])
-    return beats_time
+from lazy_sequence import LazySequence
+from encoder import encode_frames
+from renderer import create_renderer, render_geometry
+from parallel_render import ParallelRenderer
+from pipeline import Pipeline
+from overlay import AudioOverlay
+from projection import Projection
+from skeleton_export import export_skeleton_stream, export_gltf
+from sequence_store import SequenceFile, save_sequence
+from timeline import Timeline
+from notebooks.Audio_processing import read_wav, extract_beats
+from notebooks.feature_cache import content_hash, extractor_version
+from notebooks.online_beats import OnlineBeatTracker
 
 
 class VideoGenerator:
-    def __init__(self, events_extractor, moves_choice, fps=30):
+    def __init__(self, events_extractor, moves_choice, fps=30, lazy=False, orient_to_ground=False,
+                 backend='matplotlib', workers=1, preset='medium', threads=None, chunk_len=None, gop=None,
+                 frame_cache=None, overlay=None, feature_cache=None):
         self.fps = fps
         self.vid_dt = 1./fps
         self.events_extractor = events_extractor
         self.moves_choice = moves_choice
-        self.sequence = SequenceDataGen()
+        # lazy sequence computes kinematics only for frames that are actually drawn
+        self.lazy = lazy
+        self.orient_to_ground = orient_to_ground
+        # 'matplotlib' or 'numpy' (headless rasterizer, see renderer.create_renderer)
+        self.backend = backend
+        # frames are rendered on a pool of worker processes when workers > 1
+        self.workers = workers
+        # x264 preset and encoder thread count (None lets ffmpeg decide)
+        self.preset = preset
+        self.threads = threads
+        # with chunk_len set, video is encoded in chunks of chunk_len frames (rounded up to whole gops,
+        # gop defaults to fps) which are joined without re-encoding
+        self.chunk_len = chunk_len
+        self.gop = gop
+        # FrameCache consulted before drawing a frame, see frame_cache.stats() after a run
+        self.frame_cache = frame_cache
+        # None, 'spectrogram' or 'waveform': audio strip with beat ticks under the hexapod (see overlay.py)
+        self.overlay = overlay
+        # notebooks.feature_cache.FeatureCache for extracted events, kept across runs and processes
+        self.feature_cache = feature_cache
+        self.sequence = self._new_sequence()
+
+        # state of the previous run, reused by incremental regeneration
+        self.timeline = None
+        self.sequence_path = None
+        self.projection = None
+        self.audio_overlay = None
+        self._overlay_source = None
+        self._analysis = {}
+        self._segment_geometry = {}
 
     @staticmethod
     def read_wav(path):
-        signal, sr = librosa.load(path)
-        time = np.linspace(0, 1 / sr * len(signal), num=len(signal))
-        return {'signal': signal, 'time': time, 'sr': sr}
-
-    def draw_hexapod(self, fig, ax, t, leg_lines, body_poly, body_vertices):
-
-        ax.clear()
-        i = int(t / self.vid_dt)
-
-        # plot hexapod body polygon
-        poly = Poly3DCollection([body_poly[i]], alpha=0.5)
-        ax.add_collection3d(poly)
-        # plot poly vertices
-        ax.plot(body_vertices[i][0], body_vertices[i][1], body_vertices[i][2])
-        ax.scatter(body_vertices[i][0], body_vertices[i][1], body_vertices[i][2])
-        # plot legs
-        for leg in leg_lines[i]:
-            ax.plot(leg[0], leg[1], leg[2])
-            ax.scatter(leg[0], leg[1], leg[2])
-
-        # remove axis info
-        for axis in [ax.xaxis, ax.yaxis, ax.zaxis]:
-            axis._axinfo['tick']['inward_factor'] = 0.0
-            axis._axinfo['tick']['outward_factor'] = 0.0
-
-        # setup current frame settings
-        ax.set_xlim3d([-400, 400])
-        ax.set_ylim3d([-400, 400])
-        ax.set_zlim3d([0, 300])
-        # ax.margins(x=0, y=-0.25, z=50)
-        # ax.set_aspect('equal')
-        ax.view_init(elev=30, azim=75)
-
-        # plt.pause(0.1)
-        return mplfig_to_npimage(fig)
-
-    def generate_video(self, audio_path, path_to_save):
-        audio = self.read_wav(audio_path)
-        audio_len = len(audio['signal']) / audio['sr']
-        events = self.events_extractor(audio)
-        moves = self.moves_choice(events)
-        for ix, ev in enumerate(events[:-1]):
-            n_frames = int(np.floor((events[ix + 1] - events[ix]) / self.vid_dt))
-            self.sequence.get_sequence(start_pose=moves[ix], end_pose=moves[ix+1], n_frames=n_frames, reverse=False)
-            print(n_frames)
-        # filling
-        n_fr_miss = int((audio_len - len(self.sequence.leg_lines) / self.fps) * self.fps)
-        self.sequence.get_sequence(start_pose=moves[-1], end_pose=moves[-1], n_frames=n_fr_miss, reverse=False)
-        #
-        video_dur = len(self.sequence.leg_lines) / self.fps
-        fig = plt.figure()
-        ax = fig.add_subplot(projection='3d')
-        video = VideoClip(lambda x: self.draw_hexapod(fig, ax, x,
-                                                      self.sequence.leg_lines,
-                                                      self.sequence.body_poly,
-                                                      self.sequence.body_vertices),
-                          duration=video_dur)
-        audio = AudioFileClip(audio_path)
-        final_vid = video.set_audio(audio)
-        final_vid.write_videofile(fps=self.fps, codec='libx264', filename=path_to_save)
+        """
+        Memory-mapped audio, the whole signal is loaded only if the events extractor asks for it
+        """
+        return read_wav(path)
+
+    @staticmethod
+    def draw_frame(renderer, i, leg_lines, body_poly, body_vertices):
+        return renderer.render(leg_lines[i], body_poly[i], body_vertices[i])
+
+    def render_frames(self, renderer, start, stop):
+        """
+        Frames [start, stop) in order, renderer is a ParallelRenderer in parallel mode.
+        Audio overlay is added after rendering, so cached frames stay reusable at any song position
+        """
+        frames = self._render_frames(renderer, start, stop)
+        if self.audio_overlay is not None:
+            frames = self.audio_overlay.apply_frames(frames, self.fps, start)
+        yield from frames
+
+    def _render_frames(self, renderer, start, stop):
+        if isinstance(renderer, ParallelRenderer):
+            yield from renderer.frames(start, stop)
+            return
+        if hasattr(renderer, 'render_projected'):
+            # 2D backend: frames are drawn from projected points, holds and cache entries are
+            # still keyed by 3D geometry as on the other paths
+            yield from render_geometry(renderer, self.projected_frames(renderer.camera, start, stop), self.frame_cache,
+                                       lambda *arrays: renderer.render_projected(Projection.from_frame_arrays(arrays)),
+                                       keyed=True)
+            return
+        leg_lines, body_poly, body_vertices = self.sequence.leg_lines, self.sequence.body_poly, self.sequence.body_vertices
+        yield from render_geometry(renderer, ((leg_lines[i], body_poly[i], body_vertices[i]) for i in range(start, stop)),
+                                   self.frame_cache)
+
+    def projected_frames(self, camera, start, stop):
+        """
+        (3D geometry, projected frame arrays) of frames [start, stop).
+        Points of all frames are projected once per sequence and camera (see project_sequence),
+        a LazySequence is projected chunk by chunk as its kinematics are computed, so every frame goes through FK once
+        """
+        sequence = self.sequence
+        if isinstance(sequence, LazySequence):
+            size = sequence.chunk_size
+            for chunk_start in range(start - start % size, stop, size):
+                lo, hi = max(chunk_start, start), min(chunk_start + size, stop)
+                geometry = sequence[lo:hi]
+                projection = Projection.from_geometry(camera, *geometry)
+                for i in range(hi - lo):
+                    yield tuple(field[i] for field in geometry), projection.frame_arrays(i)
+            return
+        projection = self.project_sequence(camera)
+        leg_lines, body_poly, body_vertices = sequence.leg_lines, sequence.body_poly, sequence.body_vertices
+        for i in range(start, stop):
+            yield (leg_lines[i], body_poly[i], body_vertices[i]), projection.frame_arrays(i)
+
+    def project_sequence(self, camera):
+        """
+        Screen coordinates and depth of the whole sequence for the camera.
+        Kept until the sequence changes, with sequence_path set also stored next to the sequence file
+        """
+        if self.projection is not None and self.projection.camera_hash == camera.hash():
+            return self.projection
+        path = f'{self.sequence_path}.proj' if self.sequence_path is not None else None
+        meta = {'timeline_key': self.timeline.key, 'orient_to_ground': self.orient_to_ground}
+        projection = None
+        if path is not None and os.path.exists(path):
+            projection = Projection.load(path, camera, **meta)
+        if projection is None:
+            projection = Projection.compute(self.sequence, camera)
+            if path is not None:
+                projection.save(path, fps=self.fps, **meta)
+        self.projection = projection
+        return projection
+
+    def encoder_options(self):
+        options = {'preset': self.preset, 'threads': self.threads}
+        if self.chunk_len is not None:
+            options['gop'] = self.gop or self.fps
+        return options
+
+    def encode(self, frames, filename, audio_path=None):
+        """
+        Stream frames into ffmpeg, with audio_path set the audio track is muxed in the same pass
+        :return: number of encoded frames
+        """
+        return encode_frames(frames, filename, self.fps, audio_path=audio_path, **self.encoder_options())
+
+    def analyse_audio(self, audio_path):
+        """
+        Load audio and extract events once per file, consecutive runs on the same track reuse them
+        """
+        mtime = os.path.getmtime(audio_path)
+        cached = self._analysis.get(audio_path)
+        if cached is None or cached['mtime'] != mtime or cached['extractor'] is not self.events_extractor:
+            audio = self.read_wav(audio_path)
+            cached = {
+                'mtime': mtime,
+                'extractor': self.events_extractor,
+                'audio_len': audio['source'].duration,
+                # the feature cache keeps the hash, extract_events then does not read the file again
+                'audio_hash': (self.feature_cache.audio_hash(audio_path) if self.feature_cache is not None
+                               else content_hash(audio_path)),
+                'events': self.extract_events(audio_path, audio),
+            }
+            self._analysis[audio_path] = cached
+        return cached
+
+    def extract_events(self, audio_path, audio):
+        """
+        Events of the track, from the feature cache when it is set
+        """
+        if self.feature_cache is None:
+            return self.events_extractor(audio)
+        extractor = self.events_extractor
+        name = f'events:{extractor.__module__}.{extractor.__qualname__}'
+        result = self.feature_cache.cached(audio_path, name, lambda: {'events': np.asarray(extractor(audio))},
+                                           version=extractor_version(extractor), sr=audio['sr'])
+        return np.array(result['events'])
+
+    def make_overlay(self, audio_path):
+        """
+        Audio overlay of the track, the strip is kept while the track and its events do not change
+        """
+        if self.overlay is None:
+            self.audio_overlay = None
+            return None
+        analysis = self.analyse_audio(audio_path)
+        source = (analysis['audio_hash'], self.overlay, tuple(analysis['events']))
+        if self.audio_overlay is None or self._overlay_source != source:
+            self.audio_overlay = AudioOverlay(self.read_wav(audio_path), analysis['events'], kind=self.overlay)
+            self._overlay_source = source
+        return self.audio_overlay
+
+    def prepare_sequence(self, audio_path, sequence_path=None):
+        """
+        Build timeline of segments between events and compute kinematics
+        only for segments which differ from the previous run.
+        With sequence_path set, the computed sequence is stored on disk
+        and loaded (memory-mapped) on reruns with the same audio and moves
+        """
+        analysis = self.analyse_audio(audio_path)
+        moves = self.moves_choice(analysis['events'])
+        timeline = Timeline.from_events(analysis['events'], moves, analysis['audio_len'], self.fps)
+        dirty = timeline.diff(self.timeline)
+        self.sequence_path = sequence_path
+        self.projection = None
+        self.make_overlay(audio_path)
+
+        if sequence_path is not None and os.path.exists(sequence_path):
+            stored = SequenceFile(sequence_path)
+            if stored.matches(fps=self.fps, audio_hash=analysis['audio_hash'],
+                              timeline_key=timeline.key, orient_to_ground=self.orient_to_ground):
+                print(f'loaded sequence from {sequence_path}')
+                self.sequence = stored
+                self.timeline = timeline
+                return timeline, dirty
+
+        print(f'{len(dirty)} of {len(timeline)} segments to recompute')
+        self.sequence = self._new_sequence()
+        if self.lazy:
+            timeline.fill(self.sequence)
+        else:
+            geometry = {}
+            for seg in timeline.segments:
+                key = seg['key']
+                if key not in geometry:
+                    geometry[key] = self._segment_geometry.get(key) or self._compute_segment(seg)
+                self.sequence.extend(geometry[key])
+            self._segment_geometry = geometry
+
+        if sequence_path is not None:
+            save_sequence(sequence_path, self.sequence.to_arrays(), fps=self.fps,
+                          audio_hash=analysis['audio_hash'],
+                          angle_codec={'delta': True, 'keyframe_interval': self.fps},
+                          timeline_key=timeline.key, orient_to_ground=self.orient_to_ground)
+
+        self.timeline = timeline
+        return timeline, dirty
+
+    def _new_sequence(self):
+        if self.lazy:
+            return LazySequence(orient_to_ground=self.orient_to_ground)
+        return SequenceDataGen(self.orient_to_ground)
+
+    def _compute_segment(self, seg):
+        joint_sequence = self.sequence.get_ext_joints_dict(seg['start_pose'], seg['end_pose'], seg['n_frames'])
+        geometry = self.sequence.compute_geometry(joint_sequence)
+        if seg['reverse']:
+            geometry = {field: np.concatenate([arr, arr[::-1]]) for field, arr in geometry.items()}
+        return geometry
+
+    def write_segments(self, renderer, timeline, work_dir):
+        """
+        Render and encode each segment into its own clip named by the hash of its geometry and
+        render and encoder settings (see chunk_key). Clips which already exist in work_dir are reused as is
+        """
+        os.makedirs(work_dir, exist_ok=True)
+        clips = []
+        for seg in timeline.segments:
+            name = f"segment_{self.chunk_key(*seg['frames'])}"
+            filename = os.path.join(work_dir, f'{name}.mp4')
+            clips.append(filename)
+            if os.path.exists(filename):
+                continue
+            self.encode(self.render_frames(renderer, *seg['frames']), filename)
+        return clips
+
+    def chunk_ranges(self, n_frames):
+        """
+        Fixed length frame ranges starting at keyframes of the encoded stream
+        """
+        gop = self.encoder_options()['gop']
+        chunk_len = -(-self.chunk_len // gop) * gop
+        return [(start, min(start + chunk_len, n_frames)) for start in range(0, n_frames, chunk_len)]
+
+    def chunk_key(self, start, stop):
+        """
+        Hash of the chunk geometry and of the settings the chunk is rendered and encoded with
+        """
+        settings = (self.fps, self.backend, sorted(self.encoder_options().items()))
+        if self.audio_overlay is not None:
+            settings += (start, self.audio_overlay.key)
+        h = hashlib.sha1(repr(settings).encode())
+        for field in ('leg_lines', 'body_poly', 'body_vertices'):
+            frames = np.asarray(getattr(self.sequence, field)[start:stop], dtype='float64')
+            h.update(np.ascontiguousarray(frames).tobytes())
+        return h.hexdigest()[:16]
+
+    def write_chunks(self, renderer, work_dir):
+        """
+        Render and encode fixed length chunks, in worker processes in parallel mode.
+        Chunks are named by content hash, chunks which already exist in work_dir are reused
+        """
+        os.makedirs(work_dir, exist_ok=True)
+        clips, jobs = [], []
+        ranges = self.chunk_ranges(len(self.sequence.leg_lines))
+        for start, stop in ranges:
+            filename = os.path.join(work_dir, f'chunk_{self.chunk_key(start, stop)}.mp4')
+            clips.append(filename)
+            if not os.path.exists(filename) and filename not in [job[2] for job in jobs]:
+                jobs.append((start, stop, filename))
+        print(f'{len(jobs)} of {len(ranges)} chunks to encode')
+
+        if isinstance(renderer, ParallelRenderer) and self.audio_overlay is None:
+            renderer.encode_chunks(jobs, self.fps, **self.encoder_options())
+        else:
+            for start, stop, filename in jobs:
+                self.encode(self.render_frames(renderer, start, stop), filename)
+        return clips
+
+    @staticmethod
+    def concat_clips(clips, audio_path, path_to_save, work_dir):
+        """
+        Join encoded clips without re-encoding and mux the audio track
+        """
+        list_path = os.path.join(work_dir, 'clips.txt')
+        with open(list_path, 'w') as f:
+            for clip in clips:
+                f.write(f"file '{os.path.abspath(clip)}'\n")
+        cmd = [get_setting("FFMPEG_BINARY"), "-y",
+               "-f", "concat", "-safe", "0", "-i", list_path,
+               "-i", audio_path,
+               "-map", "0:v", "-map", "1:a",
+               "-c:v", "copy", "-c:a", "aac", "-shortest",
+               path_to_save]
+        subprocess_call(cmd)
+
+    def generate_video(self, audio_path, path_to_save, work_dir=None, sequence_path=None):
+        """
+        Render dance video for the audio track.
+        With work_dir set, every segment is encoded into its own clip and kept there:
+        on the next run only the segments affected by changed moves are recomputed and re-encoded.
+        With chunk_len set, fixed length chunks are encoded instead (in parallel with workers > 1),
+        work_dir then keeps chunks by content hash and only changed chunks are re-encoded.
+        With sequence_path set, kinematics are stored on disk and skipped on reruns
+        """
+        timeline, dirty = self.prepare_sequence(audio_path, sequence_path)
+        if self.frame_cache is not None:
+            self.frame_cache.reset_stats()
+        if self.workers > 1:
+            renderer = ParallelRenderer(self.sequence, self.backend, self.workers, frame_cache=self.frame_cache)
+        else:
+            renderer = create_renderer(self.backend)
+        try:
+            if self.chunk_len is not None:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    clips_dir = work_dir if work_dir is not None else tmp_dir
+                    clips = self.write_chunks(renderer, clips_dir)
+                    self.concat_clips(clips, audio_path, path_to_save, clips_dir)
+                return
+
+            if work_dir is not None:
+                clips = self.write_segments(renderer, timeline, work_dir)
+                self.concat_clips(clips, audio_path, path_to_save, work_dir)
+                return
+
+            n_frames = len(self.sequence.leg_lines)
+            self.encode(self.render_frames(renderer, 0, n_frames), path_to_save, audio_path)
+        finally:
+            renderer.close()
+            self.report_cache()
+
+    def report_cache(self):
+        if self.frame_cache is not None:
+            stats = self.frame_cache.stats()
+            print(f"frame cache: hit rate {stats['hit_rate']:.1%} ({stats['hits']} memory, "
+                  f"{stats['disk_hits']} disk, {stats['misses']} misses, {stats['evictions']} evictions)")
+
+    def preview_video(self, audio_path, path_to_save, step=4, width=480, sequence_path=None):
+        """
+        Quick preview: every step-th frame at fps / step, so frames stay aligned with the audio,
+        small frames drawn by the numpy rasterizer in simplified style and the fastest x264 preset.
+        Geometry is prepared the same way as for generate_video and kept,
+        a following full quality generate_video of the same moves does not recompute it
+        """
+        self.prepare_sequence(audio_path, sequence_path)
+        fig_w, fig_h = rcParams['figure.figsize']
+        # x264 needs even frame size
+        height = int(round(width * fig_h / fig_w / 2)) * 2
+        renderer = create_renderer('numpy', width=width, height=height, simple=True)
+        leg_lines, body_poly, body_vertices = self.sequence.leg_lines, self.sequence.body_poly, self.sequence.body_vertices
+        geometry = ((leg_lines[i], body_poly[i], body_vertices[i]) for i in range(0, len(leg_lines), step))
+        fps = Fraction(self.fps, step)
+        frames = render_geometry(renderer, geometry, self.frame_cache)
+        if self.audio_overlay is not None:
+            frames = self.audio_overlay.apply_frames(frames, fps)
+        try:
+            return encode_frames(frames, path_to_save, fps, audio_path=audio_path, preset='ultrafast', crf=30)
+        finally:
+            renderer.close()
+
+    def export_skeleton(self, audio_path, path_to_save, sequence_path=None, audio_offset=0.):
+        """
+        Export the dance as skeleton animation instead of video, no rendering:
+        binary skeleton stream for *.hxsk files, glTF animation for *.gltf
+        """
+        self.prepare_sequence(audio_path, sequence_path)
+        if path_to_save.endswith('.gltf'):
+            export_gltf(path_to_save, self.sequence, self.fps, audio_offset)
+        else:
+            export_skeleton_stream(path_to_save, self.sequence, self.fps, audio_offset)
+
+    def stream_video(self, audio_path, path_to_save, queue_size=8):
+        """
+        Render dance video as a stream: kinematics, rendering and encoding run in their own threads
+        connected by bounded queues. Kinematics are computed in chunks of one second on demand,
+        so memory stays constant for any track length and encoding starts after the first chunk.
+        Prints stage timings and returns the pipeline (see Pipeline.stats)
+        """
+        analysis = self.analyse_audio(audio_path)
+        moves = self.moves_choice(analysis['events'])
+        self.timeline = Timeline.from_events(analysis['events'], moves, analysis['audio_len'], self.fps)
+        sequence = LazySequence(chunk_size=self.fps, max_chunks=2, orient_to_ground=self.orient_to_ground)
+        self.timeline.fill(sequence)
+        self.sequence = sequence
+        self.projection = None
+        self.make_overlay(audio_path)
+        renderer = create_renderer(self.backend)
+        if self.frame_cache is not None:
+            self.frame_cache.reset_stats()
+
+        def kinematics():
+            for start in range(0, len(sequence), sequence.chunk_size):
+                yield from zip(*sequence[start:start + sequence.chunk_size])
+
+        def encode(frames):
+            return encode_frames(frames, path_to_save, self.fps, audio_path=audio_path, **self.encoder_options())
+
+        def render(geometry):
+            frames = render_geometry(renderer, geometry, self.frame_cache)
+            if self.audio_overlay is not None:
+                frames = self.audio_overlay.apply_frames(frames, self.fps)
+            return frames
+
+        pipeline = Pipeline([('kinematics', kinematics), ('render', render), ('encode', encode)], queue_size)
+        try:
+            pipeline.run()
+        finally:
+            renderer.close()
+        print(pipeline.report())
+        self.report_cache()
+        return pipeline
+
+    def live_video(self, stream, path_to_save, tracker=None, queue_size=8):
+        """
+        Dance to live audio: beats of the online tracker drive the same timeline and moves_choice
+        while the stream plays, beat tracking, kinematics, rendering and encoding run as pipeline stages.
+        A segment ends at a beat, so its frames are computed when that beat is emitted:
+        video lags the audio by up to one beat period plus the beat latency.
+        :param stream: iterable of mono sample blocks with sr, capture_time(t) and duration,
+                       e.g. notebooks.online_beats.FileAudioStream
+        :return: pipeline, see also tracker.stats() and self.timeline
+        """
+        tracker = tracker if tracker is not None else OnlineBeatTracker(stream.sr)
+        self.timeline = Timeline(self.fps)
+        self.sequence = SequenceDataGen(self.orient_to_ground)
+        self.projection = None
+        renderer = create_renderer(self.backend)
+        if self.frame_cache is not None:
+            self.frame_cache.reset_stats()
+        segment_latencies = []
+
+        def segment_frames(start_pose, end_pose, n_frames, keyframes):
+            self.timeline.add_segment(start_pose, end_pose, n_frames, keyframes)
+            if n_frames <= 0:
+                return
+            geometry = self._compute_segment(self.timeline.segments[-1])
+            yield from zip(geometry['leg_lines'], geometry['body_poly'], geometry['body_vertices'])
+
+        def kinematics(beats):
+            events, moves = [], []
+            for beat in beats:
+                events.append(beat['time'])
+                # moves are chosen from the beats known so far, the newest move ends the new segment
+                move = self.moves_choice(np.array(events))[-1]
+                start_pose = moves[-1] if moves else move
+                moves.append(move)
+                n_frames = int(beat['time'] * self.fps) - self.timeline.n_frames
+                yield from segment_frames(start_pose, move, n_frames, (max(len(moves) - 2, 0), len(moves) - 1))
+                segment_latencies.append(perf_counter() - stream.capture_time(beat['time']))
+            # hold the last move up to the end of the stream
+            if moves:
+                n_frames = int(stream.duration * self.fps) - self.timeline.n_frames
+                yield from segment_frames(moves[-1], moves[-1], n_frames, (len(moves) - 1,))
+
+        def render(geometry):
+            return render_geometry(renderer, geometry, self.frame_cache)
 
+        def encode(frames):
+            return encode_frames(frames, path_to_save, self.fps, audio_path=getattr(stream, 'path', None),
+                                 **self.encoder_options())
 
+        pipeline = Pipeline([('beats', lambda: tracker.track(stream)), ('kinematics', kinematics),
+                             ('render', render), ('encode', encode)], queue_size)
+        try:
+            pipeline.run()
+        finally:
+            renderer.close()
+        print(pipeline.report())
+        stats = tracker.stats()
+        if stats['beats']:
+            print(f"{stats['beats']} beats at {stats['tempo']:.1f} bpm, beat latency mean {stats['latency_mean'] * 1000:.0f} ms, "
+                  f"max {stats['latency_max'] * 1000:.0f} ms, segment ready {np.mean(segment_latencies) * 1000:.0f} ms "
+                  f"after its beat")
+        self.report_cache()
+        return pipeline